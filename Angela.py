@@ -1,10 +1,13 @@
-import discord, os, sys
+import time
+
+# When the script started, for the cold start breakdown printed once the bot is ready
+STARTED_AT = time.perf_counter()
+
+import discord, asyncio, os, sys
 from logging import FileHandler
 from discord.ext import commands
 from discord import app_commands
 from dotenv import load_dotenv
-import slash_commands as slash
-import filter_module
 
 print("Starting the script...\n")
 
@@ -18,6 +21,20 @@ except Exception as e:
     sys.exit(1)
 
 
+# The bot's own modules read their settings while being imported, so they come after the environment
+import slash_commands as slash
+import filter_module
+import http_client
+from ingest import IngestQueue
+from shard_metrics import ShardMetrics
+import cluster
+from command_sync import sync_commands
+import latency
+from metrics_server import MetricsServer
+
+IMPORTED_AT = time.perf_counter()
+
+
 # Set up the bot's intents
 try:
     intents = discord.Intents.default()
@@ -31,10 +48,126 @@ except Exception as e:
     sys.exit(1)
 
 
+# Pick between one gateway connection and several shards
+# Leave BOT_SHARD_COUNT empty to use the number Discord recommends
+SHARDED = os.getenv("BOT_SHARDED", "0") == "1"
+shard_options = {}
+
+if SHARDED:
+    if os.getenv("BOT_SHARD_COUNT"):
+        shard_options["shard_count"] = int(os.getenv("BOT_SHARD_COUNT"))
+    if os.getenv("BOT_SHARD_IDS"):
+        shard_options["shard_ids"] = [int(shard_id) for shard_id in os.getenv("BOT_SHARD_IDS").split(",")]
+
+BotBase = commands.AutoShardedBot if SHARDED else commands.Bot
+
+
+# How many messages are filtered at once, with a scan pool enough to keep every worker process busy
+def ingest_workers():
+    return int(os.getenv("INGEST_WORKERS", str(max(4, filter_module.scan_pool.processes * 4))))
+
+
+# Command tree that times every slash command, the time is recorded by on_app_command_completion or on_error
+class TimedCommandTree(app_commands.CommandTree):
+
+    async def interaction_check(self, interaction):
+        interaction.extras["started_at"] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction, error):
+        started_at = interaction.extras.get("started_at")
+        if started_at is not None and interaction.command is not None:
+            latency.recorder.observe(f"/{interaction.command.qualified_name}", time.perf_counter() - started_at, error=True)
+
+        await super().on_error(interaction, error)
+
+
+# Bot class that owns the shared HTTP session and background tasks for its whole lifetime
+# Every shard of an AutoShardedBot runs on this one event loop, so the per-server state in
+# filter_module and slash_commands needs no locking: it is keyed by server and only touched from the loop
+class Angela(BotBase):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Messages seen per shard, for /stats
+        self.shard_metrics = ShardMetrics()
+
+        # Set once the command tree has been checked against Discord, reconnects don't repeat it
+        self.commands_synced = False
+
+        # Samples how late the event loop runs, shown in /stats next to the command latencies
+        self.loop_lag_monitor = latency.LoopLagMonitor(
+            latency.recorder.get("event loop lag"),
+            interval=float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+        )
+
+        # Optional Prometheus endpoint, only when METRICS_PORT is set
+        self.metrics_server = MetricsServer.from_env(self)
+
+        # Seconds spent in each step of starting up: import, login, ready and sync
+        self.startup_timings = {"import": IMPORTED_AT - STARTED_AT}
+        self._run_started_at = None
+        self._logged_in_at = None
+
+        # Messages waiting for the filter pipeline, with notices dropped first once it starts filling up
+        self.ingest_queue = IngestQueue(
+            self.filter_message,
+            workers=ingest_workers(),
+            max_size=int(os.getenv("INGEST_QUEUE_SIZE", "2000")),
+            max_per_guild=int(os.getenv("INGEST_QUEUE_PER_GUILD", "200")),
+            notice_shed_at=float(os.getenv("INGEST_SHED_NOTICES_AT", "0.5")),
+            on_pressure=filter_module.action_queue.set_drop_notices
+        )
+
+    async def filter_message(self, message):
+        await filter_module.on_message_filter(message, self)
+
+    # Called by client.run before connecting, so the time until setup_hook is the login
+    async def login(self, token):
+        self._run_started_at = time.perf_counter()
+        await super().login(token)
+        self._logged_in_at = time.perf_counter()
+        self.startup_timings["login"] = self._logged_in_at - self._run_started_at
+
+    async def setup_hook(self):
+        await http_client.start()
+        slash.joke_buffer.start()
+        self.ingest_queue.start()
+        self.loop_lag_monitor.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start(asyncio.get_running_loop())
+
+        # When started by the cluster launcher, keep the other workers' settings in sync with ours
+        filter_module.cluster_bus = cluster.ClusterBus.from_env()
+        if filter_module.cluster_bus is not None:
+            await filter_module.cluster_bus.start(filter_module.invalidate_guild)
+
+    async def close(self):
+        try:
+            # Finish filtering what's queued and carry out its deletions and notices while the connection to Discord is still open
+            await self.ingest_queue.stop()
+            await filter_module.action_queue.flush()
+            await self.loop_lag_monitor.stop()
+            if self.metrics_server is not None:
+                await asyncio.to_thread(self.metrics_server.stop)
+            await slash.joke_buffer.stop()
+        finally:
+            try:
+                await super().close()
+            finally:
+                await filter_module.writer.flush()
+                filter_module.scan_pool.stop()
+                filter_module.store.close()
+                if filter_module.cluster_bus is not None:
+                    filter_module.cluster_bus.close()
+                await http_client.close()
+
+
 # Create a bot instance
 try:
-    client = commands.Bot(command_prefix='ang!', intents=intents)
-    print("Bot's instance has been created\n")
+    client = Angela(command_prefix='ang!', intents=intents, tree_cls=TimedCommandTree, **shard_options)
+    print(f"Bot's instance has been created{' in sharded mode' if SHARDED else ''}\n")
 except Exception as e:
     print(f"Error creating bot instance: {e}\n")
     sys.exit(1)
@@ -58,22 +191,69 @@ slash.set_client(client)
 async def on_ready():
     print(f'Successfully logged in as {client.user.name}.\n')
 
-    # sync commands with discord
+    # Only the first on_ready counts towards the cold start, later ones are reconnects
+    first_ready = "ready" not in client.startup_timings
+    if first_ready and client._logged_in_at is not None:
+        client.startup_timings["ready"] = time.perf_counter() - client._logged_in_at
+
+    # Load moderation settings for every server in the background, if enabled
+    filter_module.start_warm_up([guild.id for guild in client.guilds])
+
+    # sync commands with discord, only once per run and only if they changed since the last sync
+    # in a cluster, the first worker does it for everyone
     try:
-        print("Attempting to sync commands...\n")
-        synced = await client.tree.sync()
-        print(f"Synced {len(synced)} commands.")
-        for cmd in synced:
-            print(f"  - Synced: {cmd.name}.")
+        if not client.commands_synced and os.getenv("CLUSTER_WORKER_ID", "0") == "0":
+            print("Attempting to sync commands...\n")
+            sync_started_at = time.perf_counter()
+            synced = await sync_commands(
+                client,
+                force=os.getenv("COMMAND_SYNC_FORCE", "0") == "1",
+                guild_id=int(os.getenv("COMMAND_SYNC_GUILD")) if os.getenv("COMMAND_SYNC_GUILD") else None
+            )
+            client.commands_synced = True
+            client.startup_timings["sync"] = time.perf_counter() - sync_started_at
+
+            if synced is None:
+                print("Commands haven't changed since the last sync, skipping it.")
+            else:
+                print(f"Synced {len(synced)} commands.")
+                for cmd in synced:
+                    print(f"  - Synced: {cmd.name}.")
     except Exception as error:
         print(f"Failed to sync commands: {error}.")
     finally:
         print("\nBot is now operational")
 
+        if first_ready:
+            breakdown = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in client.startup_timings.items())
+            print(f"Cold start: {breakdown}, total {time.perf_counter() - STARTED_AT:.2f}s\n")
+
+
+# Report each shard as it connects, only fires in sharded mode
+@client.event
+async def on_shard_ready(shard_id):
+    print(f"Shard {shard_id} is ready.\n")
+
+
+# Forget a server's moderation settings once the bot leaves it, they stay saved in case it comes back
+@client.event
+async def on_guild_remove(guild):
+    filter_module.invalidate_guild(guild.id)
+
+
+# Record how long a slash command took, failed ones are recorded by TimedCommandTree.on_error
+@client.event
+async def on_app_command_completion(interaction, command):
+    started_at = interaction.extras.get("started_at")
+    if started_at is not None:
+        latency.recorder.observe(f"/{command.qualified_name}", time.perf_counter() - started_at)
+
 
 # Event listener to handle messages
 @client.event
 async def on_message(message):
+    client.shard_metrics.record(message.guild.shard_id if message.guild else 0)
+
     # Skip messages from the bot itself
     if message.author == client.user:
         return
@@ -81,8 +261,9 @@ async def on_message(message):
     # Process commands
     await client.process_commands(message)
     
-    # Use the NSFW filter module
-    await filter_module.on_message_filter(message, client)
+    # Hand the message to the NSFW filter workers, unless nothing can be filtered here
+    if message.guild and filter_module.needs_filtering(message.guild.id, message.channel.id):
+        client.ingest_queue.submit(message.guild.id, message)
 
 
 # coinflip command
@@ -92,10 +273,10 @@ async def coin(interaction: discord.Interaction):
 
 
 # exchange rate command
-@client.tree.command(name="exchange", description="Convert an amount from EUR to a target currency.")
-@app_commands.describe(amount="The amount of EUR you want to convert", target_currency="The 3-letter currency code (e.g., USD, GBP, JPY)")
-async def get_exchange_rate(interaction: discord.Interaction, amount: float, target_currency: str):
-    await slash.get_exchange_rate_implementation(interaction, amount, target_currency)
+@client.tree.command(name="exchange", description="Convert an amount from one currency to another.")
+@app_commands.describe(amount="The amount you want to convert", target_currency="The 3-letter currency code (e.g., USD, GBP, JPY)", source_currency="The 3-letter code of the currency you have (defaults to EUR)")
+async def get_exchange_rate(interaction: discord.Interaction, amount: float, target_currency: str, source_currency: str = "EUR"):
+    await slash.get_exchange_rate_implementation(interaction, amount, target_currency, source_currency)
 
 
 # ping and RAM
@@ -104,6 +285,15 @@ async def stats(interaction: discord.Interaction):
     await slash.stats(interaction, client)
 
 
+# profile the bot for a while, owner only
+@client.tree.command(name="profile", description="Profile the bot for a while and get the hottest functions (owner only).")
+@app_commands.describe(seconds="How long to profile for", messages="Stop early after this many filtered messages", top="How many functions to list", sort="Sort by time including calls (cumulative) or time in the function itself (tottime)")
+@app_commands.choices(sort=[app_commands.Choice(name="cumulative", value="cumulative"), app_commands.Choice(name="tottime", value="tottime")])
+@app_commands.default_permissions(administrator=True)
+async def profile(interaction: discord.Interaction, seconds: int = 10, messages: int = 0, top: int = 25, sort: str = "cumulative"):
+    await slash.profile(interaction, client, seconds, messages, top, sort)
+
+
 # token command
 @client.tree.command(name="token", description="Displays the bot's token.")
 async def token(interaction: discord.Interaction):
@@ -163,6 +353,9 @@ def main():
             print("Error: No Discord token found. Please set TOKEN environment variable.")
             sys.exit(1)
 
+        # The scan workers have to be started before anything opens a thread
+        filter_module.scan_pool.start()
+
         client.run(bot_token, log_handler=handler)
 
     except Exception as error:
@@ -170,8 +363,16 @@ def main():
         sys.exit(1)
 
 
+# Run several bot processes, each with a share of the shards: py Angela.py --cluster
+def cluster_main():
+    cluster.main()
+
+
 # make sure the bot is run directly
 if __name__ == '__main__':
-    main()
+    if "--cluster" in sys.argv:
+        cluster_main()
+    else:
+        main()
 else:
     print("Please run the Angela.py file directly.")
\ No newline at end of file
@@ -0,0 +1,78 @@
+import time
+
+
+# Discord refuses messages longer than this
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+# Pull the text pieces out of a streamed chat completion
+# Works with OpenAI's chunk objects and with plain dicts, so a fake stream can be fed in for testing
+async def iter_completion_text(stream):
+    async for chunk in stream:
+        choices = chunk["choices"]
+        if not choices:
+            continue
+
+        text = choices[0]["delta"].get("content")
+        if text:
+            yield text
+
+
+# A followup message that grows as text arrives, edited at most once per interval
+class ProgressiveMessage:
+
+    def __init__(self, followup, interval=1.5, clock=time.monotonic):
+        # followup needs send(content, wait=True) returning a message with edit(content=...)
+        self.followup = followup
+        self.interval = interval
+        self.clock = clock
+
+        self.message = None
+        self.shown = ""
+        self.text = ""
+        self.last_edit = 0.0
+        self.edits = 0
+
+    async def _show(self, content):
+        if self.message is None:
+            self.message = await self.followup.send(content, wait=True)
+        else:
+            await self.message.edit(content=content)
+            self.edits += 1
+
+        self.shown = content
+        self.last_edit = self.clock()
+
+    # Add text, moving to a new message when the current one is full
+    async def append(self, text):
+        self.text += text
+
+        while len(self.text) > DISCORD_MESSAGE_LIMIT:
+            full, self.text = self.text[:DISCORD_MESSAGE_LIMIT], self.text[DISCORD_MESSAGE_LIMIT:]
+            await self._show(full)
+            self.message = None
+            self.shown = ""
+
+        # The first piece is sent right away, later ones wait for the throttle window
+        if self.text and self.text != self.shown:
+            if self.message is None or self.clock() - self.last_edit >= self.interval:
+                await self._show(self.text)
+
+    # Make sure the last received text is on screen
+    async def finish(self):
+        if self.text and self.text != self.shown:
+            await self._show(self.text)
+
+
+# Relay a streamed completion into Discord and return the full answer
+async def stream_completion(stream, followup, interval=1.5):
+    progressive = ProgressiveMessage(followup, interval)
+    answer = []
+
+    async for text in iter_completion_text(stream):
+        answer.append(text)
+        await progressive.append(text)
+
+    await progressive.finish()
+
+    return "".join(answer)
@@ -0,0 +1,286 @@
+import argparse, asyncio, contextlib, datetime, io, json, random, string, sys, time, tracemalloc
+import filter_module
+from media_rules import MEDIA_FLAGS
+
+# Replays messages through filter_module.on_message_filter without Discord, to measure filter throughput
+# py benchmark.py --messages 20000 --words 500 --media-channels 0.3
+# py benchmark.py --replay messages.jsonl
+#
+# A recorded stream has one JSON object per line, every field is optional:
+# {"guild_id": 1, "channel_id": 10, "content": "hello", "content_types": ["image/png"], "embeds": 0}
+
+
+# Lightweight stand-ins for the discord.py objects the filter touches
+
+class FakeUser:
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+
+    def __init__(self, guild_id, shard_id=0):
+        self.id = guild_id
+        self.shard_id = shard_id
+
+
+class FakeChannel:
+
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.deleted = 0
+        self.sent = 0
+
+    async def delete_messages(self, messages):
+        self.deleted += len(messages)
+
+    async def send(self, content, delete_after=None):
+        self.sent += 1
+
+
+class FakeAttachment:
+
+    def __init__(self, content_type):
+        self.content_type = content_type
+
+
+class FakeEmbed:
+    pass
+
+
+class FakeMessage:
+
+    def __init__(self, content, channel, author, attachments=(), embeds=()):
+        self.content = content
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.attachments = list(attachments)
+        self.embeds = list(embeds)
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+
+    async def delete(self):
+        self.channel.deleted += 1
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.user = FakeUser(0)
+
+
+CONTENT_TYPES = ["image/png", "image/jpeg", "video/mp4", "application/pdf", "text/plain"]
+
+
+def random_word(rng, min_length=3, max_length=10):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(min_length, max_length)))
+
+
+# Number of words in a message for each length profile
+def message_length(rng, profile):
+    if profile == "short":
+        return rng.randint(1, 10)
+    if profile == "long":
+        return rng.randint(200, 400)
+
+    # Mostly short chat lines with the occasional wall of text
+    return min(int(rng.lognormvariate(2.3, 0.9)) + 1, 400)
+
+
+# Give every server a banned word list and some channels media rules, straight into filter_module's state
+def set_up_guilds(rng, guild_count, channels_per_guild, word_count, media_channels):
+    guilds = []
+    banned_words = [random_word(rng, 4, 12) for _ in range(word_count)]
+
+    for index in range(guild_count):
+        guild = FakeGuild(1000 + index)
+        channels = [FakeChannel(guild.id * 100 + number, guild) for number in range(channels_per_guild)]
+
+        filter_module.guild_filter_lists[guild.id] = list(banned_words)
+        filter_module.guild_media_filters[guild.id] = {
+            channel.id: rng.choice(list(MEDIA_FLAGS.values())) | rng.choice([0] + list(MEDIA_FLAGS.values()))
+            for channel in channels
+            if rng.random() < media_channels
+        }
+        filter_module.update_moderation_index(guild.id)
+        guilds.append((guild, channels))
+
+    return guilds, banned_words
+
+
+def synthetic_messages(rng, guilds, banned_words, options):
+    vocabulary = [random_word(rng) for _ in range(2000)]
+    authors = [FakeUser(user_id) for user_id in range(1, 200)]
+    messages = []
+
+    for _ in range(options.messages):
+        guild, channels = rng.choice(guilds)
+        channel = rng.choice(channels)
+
+        words = [rng.choice(vocabulary) for _ in range(message_length(rng, options.length))]
+        if banned_words and rng.random() < options.hit_rate:
+            words[rng.randrange(len(words))] = rng.choice(banned_words)
+        if rng.random() < options.links:
+            words.append("https://example.com/" + rng.choice(vocabulary))
+
+        attachments = [FakeAttachment(rng.choice(CONTENT_TYPES))] if rng.random() < options.attachments else []
+        embeds = [FakeEmbed()] if rng.random() < options.embeds else []
+
+        messages.append(FakeMessage(" ".join(words), channel, rng.choice(authors), attachments, embeds))
+
+    return messages
+
+
+# Load a recorded stream, servers and channels not set up yet get the same banned words and no media rules
+def recorded_messages(path, guilds, banned_words):
+    channels = {channel.id: channel for _, guild_channels in guilds for channel in guild_channels}
+    known_guilds = {guild.id: guild for guild, _ in guilds}
+    author = FakeUser(1)
+    messages = []
+
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            guild_id = record.get("guild_id", guilds[0][0].id)
+            channel_id = record.get("channel_id", guilds[0][1][0].id)
+
+            if guild_id not in known_guilds:
+                known_guilds[guild_id] = FakeGuild(guild_id)
+                filter_module.guild_filter_lists[guild_id] = list(banned_words)
+                filter_module.update_moderation_index(guild_id)
+
+            if channel_id not in channels:
+                channels[channel_id] = FakeChannel(channel_id, known_guilds[guild_id])
+
+            messages.append(FakeMessage(
+                record.get("content", ""),
+                channels[channel_id],
+                author,
+                [FakeAttachment(content_type) for content_type in record.get("content_types", [])],
+                [FakeEmbed() for _ in range(record.get("embeds", 0))]
+            ))
+
+    return messages
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)]
+
+
+# Run the messages through the filter, `concurrency` at a time like the bot's ingest workers
+# Returns each message's latency in seconds
+async def replay(messages, client, concurrency=1):
+    latencies = []
+    on_message_filter = filter_module.on_message_filter
+    clock = time.perf_counter
+
+    async def worker(stream):
+        for message in stream:
+            started_at = clock()
+            await on_message_filter(message, client)
+            latencies.append(clock() - started_at)
+
+    await asyncio.gather(*(worker(messages[start::concurrency]) for start in range(concurrency)))
+    return latencies
+
+
+async def run(options):
+    rng = random.Random(options.seed)
+    client = FakeClient()
+
+    # Deletions are counted, not waited for
+    filter_module.action_queue.window = 3600
+    filter_module.scan_pool.processes = options.scan_processes
+    filter_module.scan_pool.start()
+
+    # Same default as the bot's INGEST_WORKERS
+    concurrency = options.concurrency or max(4, options.scan_processes * 4)
+
+    guilds, banned_words = set_up_guilds(rng, options.guilds, options.channels, options.words, options.media_channels)
+
+    if options.replay:
+        messages = recorded_messages(options.replay, guilds, banned_words)
+    else:
+        messages = synthetic_messages(rng, guilds, banned_words, options)
+
+    # The filter prints every deletion, keep that out of the measurement
+    output = sys.stdout if options.verbose else io.StringIO()
+
+    with contextlib.redirect_stdout(output):
+        # Warm up: compile the matchers and start the scan pool before timing anything
+        await replay(messages[:options.warmup], client, concurrency)
+
+        deleted_before = sum(filter_module.messages_deleted.values())
+        started_at = time.perf_counter()
+        latencies = await replay(messages, client, concurrency)
+        elapsed = time.perf_counter() - started_at
+        deleted = sum(filter_module.messages_deleted.values()) - deleted_before
+
+        # Allocations are measured in a separate pass, tracemalloc slows everything down
+        allocation_messages = messages[:options.allocation_messages]
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        await replay(allocation_messages, client, concurrency)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        await filter_module.flush()
+        filter_module.scan_pool.stop()
+
+    latencies.sort()
+    size_diff = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    total_words = sum(len(message.content.split()) for message in messages)
+
+    print(f"Messages:     {len(messages)} ({total_words / max(len(messages), 1):.1f} words on average), {deleted} deleted")
+    print(f"Servers:      {len(guilds)} with {options.words} banned words each, scan processes: {options.scan_processes}, {concurrency} at a time")
+    print(f"Throughput:   {len(messages) / elapsed:,.0f} messages/sec")
+    print("Latency:      p50 {:.1f} us, p95 {:.1f} us, p99 {:.1f} us, max {:.1f} us".format(
+        *(value * 1_000_000 for value in (
+            percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99), latencies[-1] if latencies else 0.0
+        ))
+    ))
+    print(f"Allocations:  peak {peak / 1024:.1f} KiB, {size_diff / max(len(allocation_messages), 1):.0f} bytes retained per message "
+          f"over {len(allocation_messages)} messages")
+
+    if options.top_allocations:
+        print("\nTop allocation sites:")
+        for stat in after.compare_to(before, "lineno")[:options.top_allocations]:
+            print(f"  {stat}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the message filter offline with synthetic or recorded messages.")
+    parser.add_argument("--messages", type=int, default=20000, help="synthetic messages to replay")
+    parser.add_argument("--guilds", type=int, default=10, help="servers the messages are spread over")
+    parser.add_argument("--channels", type=int, default=5, help="channels per server")
+    parser.add_argument("--words", type=int, default=200, help="banned words per server")
+    parser.add_argument("--media-channels", type=float, default=0.3, help="share of channels with media rules")
+    parser.add_argument("--length", choices=["short", "mixed", "long"], default="mixed", help="message length profile")
+    parser.add_argument("--hit-rate", type=float, default=0.02, help="share of messages containing a banned word")
+    parser.add_argument("--attachments", type=float, default=0.1, help="share of messages with an attachment")
+    parser.add_argument("--links", type=float, default=0.05, help="share of messages with a link")
+    parser.add_argument("--embeds", type=float, default=0.02, help="share of messages with an embed")
+    parser.add_argument("--replay", help="JSON lines file of recorded messages to replay instead")
+    parser.add_argument("--scan-processes", type=int, default=0, help="scan in this many worker processes, like SCAN_PROCESSES")
+    parser.add_argument("--concurrency", type=int, default=0, help="messages filtered at once, like INGEST_WORKERS (default: the bot's default)")
+    parser.add_argument("--warmup", type=int, default=500, help="messages replayed before timing starts")
+    parser.add_argument("--allocation-messages", type=int, default=2000, help="messages replayed under tracemalloc")
+    parser.add_argument("--top-allocations", type=int, default=0, help="list this many allocation sites")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show the filter's own output")
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
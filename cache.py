@@ -0,0 +1,132 @@
+import asyncio, sys, time
+from collections import OrderedDict
+
+
+# Default way of estimating how much memory an entry takes
+def default_sizeof(key, value):
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+# In-memory cache with least-recently-used eviction, per-entry expiry and a memory cap
+class TTLCache:
+
+    def __init__(self, max_entries=1024, ttl=3600, max_bytes=None, sizeof=default_sizeof, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.clock = clock
+
+        # key -> (expires_at, size, value), oldest first
+        self._entries = OrderedDict()
+        # key -> future shared by everyone waiting on the same load
+        self._inflight = {}
+
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    # Share of lookups answered from the cache, in percent
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return (self.hits / total * 100) if total else 0.0
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    # Look up a key, expired entries count as a miss
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            if entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+            self._drop(key)
+            self.expirations += 1
+
+        self.misses += 1
+        return default
+
+    # Store a value, evicting the least recently used entries to stay within the limits
+    # A ttl of zero or less means the value isn't worth keeping
+    def set(self, key, value, ttl=None):
+        if key in self._entries:
+            self._drop(key)
+
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        size = self.sizeof(key, value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        expires_at = self.clock() + ttl
+        self._entries[key] = (expires_at, size, value)
+        self.bytes += size
+
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        self._drop(key)
+        return entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    # Return the cached value, or run loader once no matter how many callers ask for the same key
+    # Values of None are handed back to every waiter but not stored
+    # ttl may be a function of the loaded value, so different results can be kept for different times
+    async def get_or_load(self, key, loader, ttl=None):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            if value is not None:
+                self.set(key, value, ttl(value) if callable(ttl) else ttl)
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
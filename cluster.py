@@ -0,0 +1,177 @@
+import asyncio, json, os, signal, socket, subprocess, sys, time, urllib.request
+from dotenv import load_dotenv
+
+
+# Tells the other bot processes on this machine which servers changed, over loopback UDP
+# No broker is needed: every worker listens on its own port and sends to all the others
+class ClusterBus:
+
+    def __init__(self, worker_id, port, peer_ports, host="127.0.0.1"):
+        self.worker_id = worker_id
+        self.port = port
+        self.peer_ports = [peer_port for peer_port in peer_ports if peer_port != port]
+        self.host = host
+
+        # Plain socket for sending, safe to use from the worker threads that save settings
+        self._sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._transport = None
+
+        self.sent = 0
+        self.received = 0
+
+    # Build the bus from the variables the launcher sets, None when not running in a cluster
+    @classmethod
+    def from_env(cls):
+        if not os.getenv("CLUSTER_PORT"):
+            return None
+
+        peer_ports = [int(port) for port in os.getenv("CLUSTER_PEERS", "").split(",") if port]
+        return cls(int(os.getenv("CLUSTER_WORKER_ID", "0")), int(os.getenv("CLUSTER_PORT")), peer_ports)
+
+    # Start listening, on_change(guild_id) is called for every change made by another worker
+    async def start(self, on_change):
+        bus = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                try:
+                    change = json.loads(data)
+                except ValueError:
+                    return
+
+                if change.get("origin") == bus.worker_id:
+                    return
+
+                bus.received += 1
+                on_change(change["guild_id"])
+
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(Protocol, local_addr=(self.host, self.port))
+        print(f"Cluster worker {self.worker_id} listening for changes on port {self.port}\n")
+
+    # Let every other worker know a server's settings changed
+    def publish(self, guild_id):
+        data = json.dumps({"origin": self.worker_id, "guild_id": guild_id}).encode()
+
+        for peer_port in self.peer_ports:
+            try:
+                self._sender.sendto(data, (self.host, peer_port))
+                self.sent += 1
+            except OSError as error:
+                print(f"Failed to notify cluster worker on port {peer_port}: {error}")
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+        self._sender.close()
+
+
+# Ask Discord how many shards it recommends for this bot
+def fetch_recommended_shards(token):
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "Angela cluster launcher"}
+    )
+
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)["shards"]
+
+
+# Split shard ids 0..shard_count-1 into one contiguous range per worker
+def split_shards(shard_count, workers):
+    ranges = []
+    start = 0
+
+    for worker_id in range(workers):
+        size = shard_count // workers + (1 if worker_id < shard_count % workers else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+
+    return [shard_ids for shard_ids in ranges if shard_ids]
+
+
+# Environment for one worker process
+def worker_env(worker_id, shard_ids, shard_count, ports):
+    env = dict(os.environ)
+
+    env["BOT_SHARDED"] = "1"
+    env["BOT_SHARD_COUNT"] = str(shard_count)
+    env["BOT_SHARD_IDS"] = ",".join(str(shard_id) for shard_id in shard_ids)
+    env["CLUSTER_WORKER_ID"] = str(worker_id)
+    env["CLUSTER_PORT"] = str(ports[worker_id])
+    env["CLUSTER_PEERS"] = ",".join(str(port) for port in ports)
+
+    # Workers have to see each other's changes, so share one database and save changes right away
+    env.setdefault("MODERATION_STORE", "sqlite")
+    env.setdefault("FILTER_SAVE_DELAY", "0")
+
+    return env
+
+
+# Start the workers and restart any that crash, until the launcher is stopped
+def main():
+    load_dotenv()
+
+    workers = int(os.getenv("CLUSTER_WORKERS", str(os.cpu_count() or 1)))
+    base_port = int(os.getenv("CLUSTER_BASE_PORT", "47800"))
+
+    if os.getenv("CLUSTER_SHARDS"):
+        shard_count = int(os.getenv("CLUSTER_SHARDS"))
+    else:
+        token = os.getenv("TOKEN")
+        if not token:
+            print("Error: No Discord token found. Please set TOKEN environment variable.")
+            sys.exit(1)
+        shard_count = fetch_recommended_shards(token)
+
+    # Never more workers than shards
+    shard_ranges = split_shards(shard_count, workers)
+    ports = [base_port + worker_id for worker_id in range(len(shard_ranges))]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Angela.py")
+
+    def start_worker(worker_id):
+        shard_ids = shard_ranges[worker_id]
+        print(f"Starting worker {worker_id} with shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}\n")
+        return subprocess.Popen([sys.executable, script], env=worker_env(worker_id, shard_ids, shard_count, ports))
+
+    processes = [start_worker(worker_id) for worker_id in range(len(shard_ranges))]
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        while not stopping:
+            time.sleep(1)
+
+            for worker_id, process in enumerate(processes):
+                if process.poll() is not None and not stopping:
+                    print(f"Worker {worker_id} exited with code {process.returncode}, restarting it.\n")
+                    time.sleep(5)
+
+                    # A stop signal during the wait would leave the new worker running
+                    if stopping:
+                        break
+                    processes[worker_id] = start_worker(worker_id)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        print("All cluster workers stopped.")
+
+
+if __name__ == '__main__':
+    main()
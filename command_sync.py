@@ -0,0 +1,38 @@
+import hashlib, json
+import discord
+from persistence import atomic_write_json, read_json
+
+
+# Stable hash of every command registered on the tree, as Discord would receive them
+def tree_fingerprint(tree, guild=None):
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+        key=lambda command: (command.get("type", 1), command["name"])
+    )
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+# Sync the command tree only when it differs from the last one synced
+# Returns the synced commands, or None when the sync was skipped
+async def sync_commands(client, force=False, guild_id=None, state_path=".command_sync.json"):
+    tree = client.tree
+    guild = discord.Object(id=guild_id) if guild_id else None
+
+    if guild is not None:
+        # During development, commands show up in one server right away instead of waiting for a global sync
+        tree.copy_global_to(guild=guild)
+
+    target = f"{client.application_id}:{guild_id or 'global'}"
+    fingerprint = tree_fingerprint(tree, guild)
+
+    state = read_json(state_path, {})
+    if not force and state.get(target) == fingerprint:
+        return None
+
+    synced = await tree.sync(guild=guild)
+
+    state[target] = fingerprint
+    atomic_write_json(state_path, state)
+
+    return synced
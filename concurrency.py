@@ -0,0 +1,96 @@
+import asyncio, time
+from contextlib import asynccontextmanager
+
+
+# Raised when a limiter can't hand out a slot in time
+class LimiterBusy(Exception):
+    pass
+
+
+# Caps how many jobs run at once, both overall and per server, with a bounded waiting line
+class ConcurrencyLimiter:
+
+    def __init__(self, max_concurrent, max_per_guild, max_queue, max_wait):
+        self.max_concurrent = max_concurrent
+        self.max_per_guild = max_per_guild
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._global = asyncio.Semaphore(max_concurrent)
+        self._guilds = {}
+        self._guild_users = {}
+
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    # Get the semaphore for a server, created on first use and dropped once idle
+    def _guild_semaphore(self, guild_id):
+        semaphore = self._guilds.get(guild_id)
+
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_guild)
+            self._guilds[guild_id] = semaphore
+            self._guild_users[guild_id] = 0
+
+        self._guild_users[guild_id] += 1
+        return semaphore
+
+    def _release_guild(self, guild_id):
+        self._guild_users[guild_id] -= 1
+
+        if self._guild_users[guild_id] == 0:
+            del self._guilds[guild_id]
+            del self._guild_users[guild_id]
+
+    async def _acquire(self, guild_semaphore):
+        deadline = time.monotonic() + self.max_wait
+
+        await asyncio.wait_for(guild_semaphore.acquire(), timeout=self.max_wait)
+
+        try:
+            remaining = max(deadline - time.monotonic(), 0)
+            await asyncio.wait_for(self._global.acquire(), timeout=remaining)
+        except BaseException:
+            guild_semaphore.release()
+            raise
+
+    # Hold a slot for the duration of the block, raises LimiterBusy if the line is full or too slow
+    @asynccontextmanager
+    async def slot(self, guild_id=None):
+        guild_semaphore = self._guild_semaphore(guild_id)
+
+        # Take a free slot straight away, only queue when one of the limits is reached
+        if not guild_semaphore.locked() and not self._global.locked():
+            await guild_semaphore.acquire()
+            await self._global.acquire()
+
+        elif self.waiting >= self.max_queue:
+            self.rejected += 1
+            self._release_guild(guild_id)
+            raise LimiterBusy()
+
+        else:
+            self.waiting += 1
+
+            try:
+                await self._acquire(guild_semaphore)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                self._release_guild(guild_id)
+                raise LimiterBusy()
+            except BaseException:
+                self._release_guild(guild_id)
+                raise
+            finally:
+                self.waiting -= 1
+
+        self.active += 1
+
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._global.release()
+            guild_semaphore.release()
+            self._release_guild(guild_id)
@@ -0,0 +1,83 @@
+import asyncio, time
+
+
+# Raised by a rate table fetcher when the upstream doesn't return usable rates
+class RateFetchError(Exception):
+    pass
+
+
+# Keeps a full table of EUR-based rates in memory and converts between any two currencies locally
+class RateTable:
+
+    def __init__(self, fetch, max_age=3600, retry_interval=60, clock=time.monotonic):
+        # fetch is a coroutine function returning a {currency: rate} dict, based on `base`
+        self.fetch = fetch
+        self.max_age = max_age
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.base = "EUR"
+
+        self.rates = None
+        self.fetched_at = None
+        self._refresh = None
+        self._retry_at = 0.0
+
+        self.refreshes = 0
+        self.failures = 0
+        self.stale_served = 0
+
+    @property
+    def is_fresh(self):
+        return self.rates is not None and self.clock() - self.fetched_at < self.max_age
+
+    async def _do_refresh(self):
+        try:
+            rates = dict(await self.fetch())
+            rates[self.base] = 1.0
+
+            self.rates = rates
+            self.fetched_at = self.clock()
+            self.refreshes += 1
+
+        except Exception as error:
+            self.failures += 1
+            self._retry_at = self.clock() + self.retry_interval
+            print(f"Error refreshing exchange rates: {error}")
+
+        finally:
+            self._refresh = None
+
+    # Get the current table, refreshing it once for all callers when it is too old
+    # Falls back to the old table if the refresh fails, returns None if there has never been one
+    async def get_rates(self):
+        if self.is_fresh:
+            return self.rates
+
+        # Don't hammer an upstream that just failed, keep serving the old table for a while
+        if self.rates is not None and self.clock() < self._retry_at:
+            self.stale_served += 1
+            return self.rates
+
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._do_refresh())
+
+        await asyncio.shield(self._refresh)
+
+        if self.rates is not None and not self.is_fresh:
+            self.stale_served += 1
+
+        return self.rates
+
+    # Rate to turn one unit of source into target, or None if either currency is unknown
+    async def get_rate(self, source, target):
+        rates = await self.get_rates()
+        if not rates:
+            return None
+
+        source_rate = rates.get(source)
+        target_rate = rates.get(target)
+        if not source_rate or target_rate is None:
+            return None
+
+        # Both rates are relative to the base currency, so cross them
+        return target_rate / source_rate
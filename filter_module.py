@@ -1,70 +1,330 @@
-import discord, json, os
+import discord, asyncio, itertools, os, time
 from discord import app_commands
+from word_matcher import WordMatcher
+from persistence import WriteBehind
+from moderation_store import open_store
+import media_rules
+from moderation_queue import ModerationQueue
+from scan_pool import ScanPool
+from latency import timed
+from guild_cache import GuildCache
+from media_rules import MEDIA_TYPES, MEDIA_FLAGS
+
+# Where moderation settings are kept, JSON files or SQLite depending on MODERATION_STORE
+store = open_store()
 
-# Directories
-media_filter_DIR = 'media_filters'
-FILTER_DIR = 'filter_lists'
+# Dictionary to store filter lists for each server
+guild_filter_lists = {}
 
-# Ensure the directories exist
-if not os.path.exists(media_filter_DIR):
-    os.makedirs(media_filter_DIR)
+# Dictionary to store media filter settings for each server, as {channel_id: media_rules bitmask}
+# Only channels with at least one media type filtered are kept
+guild_media_filters = {}
 
-if not os.path.exists(FILTER_DIR):
-    os.makedirs(FILTER_DIR)
+# Dictionary to store the compiled word matcher for each server
+guild_word_matchers = {}
+
+# Version of each server's filter list, changes whenever the list does so scan workers know to recompile
+guild_filter_versions = {}
+_filter_version_counter = itertools.count(1)
+
+# Scan messages in worker processes instead of on the event loop, 0 processes keeps scanning here
+scan_pool = ScanPool(int(os.getenv("SCAN_PROCESSES", "0")))
+
+# Tells other bot processes about saved changes when running as a cluster, see cluster.py
+cluster_bus = None
+
+# Saves changed settings in the background, a burst of edits becomes a single write
+writer = WriteBehind(delay=float(os.getenv("FILTER_SAVE_DELAY", "1")))
+
+# Which servers and channels have anything to filter: guild_id -> (has banned words, {channel_id: media mask})
+# Servers missing from it haven't been loaded yet
+moderation_index = {}
+
+# Deletions and user notices, batched per channel
+action_queue = ModerationQueue(
+    window=float(os.getenv("MODERATION_BATCH_WINDOW", "1")),
+    max_batch=int(os.getenv("MODERATION_BATCH_SIZE", "100")),
+    notice_ttl=float(os.getenv("MODERATION_NOTICE_TTL", "10"))
+)
+
+# Changes not written yet when running as a cluster, where each worker saves only what it changed so
+# it can't undo a change another worker just made: guild_id -> {word: added}, guild_id -> {(channel_id, media_type): is_filtered}
+_pending_word_changes = {}
+_pending_media_changes = {}
+
+# Messages checked by the filter, and messages removed for media ("media") or banned words ("words")
+messages_scanned = 0
+messages_deleted = {"media": 0, "words": 0}
+
+# Which servers are kept in memory, idle ones and the least recently used beyond GUILD_CACHE_SIZE are dropped
+# A server with a change still being saved stays, so it can't be reloaded from outdated data
+guild_cache = GuildCache(
+    lambda guild_id: _evict_guild(guild_id),
+    max_guilds=int(os.getenv("GUILD_CACHE_SIZE", "5000")),
+    idle_ttl=float(os.getenv("GUILD_CACHE_IDLE", "3600")),
+    can_evict=lambda guild_id: not _save_pending(guild_id)
+)
+
+# Servers dropped from memory that had nothing to filter, so their messages can still be skipped without loading them
+# A filter command or a change saved by another cluster worker clears the mark, it's only a set of ids
+_inactive_guilds = set()
+
+# Servers whose settings are being loaded right now, guild_id -> future resolved once they are ready
+_guild_loads = {}
+
+# Warm-up settings, see warm_up()
+WARMUP_ENABLED = os.getenv("MODERATION_WARMUP", "0") == "1"
+WARMUP_CONCURRENCY = int(os.getenv("MODERATION_WARMUP_CONCURRENCY", "4"))
+WARMUP_BATCH_SIZE = int(os.getenv("MODERATION_WARMUP_BATCH", "100"))
+_warmup_task = None
+
+# Load the filter list for a specific server
+def load_filter_list(guild_id):
+    filter_list = store.load_filter_list(guild_id)
 
-# Media types that can be filtered
-MEDIA_TYPES = ['images', 'videos', 'links', 'files', 'embeds']
+    if filter_list is None:
+        print(f"Filter list for server {guild_id} not found. Creating a new one.\n")
+        filter_list = []
+    else:
+        print(f"Filter list for server {guild_id} loaded successfully.\n")
 
-# Dictionary to store filter lists for each server
-guild_filter_lists = {}
+    return filter_list
 
-# Dictionary to store media filter settings for each server
-guild_media_filters = {}
+# Queue the media filter settings of a server to be saved
+# changes is {(channel_id, media_type): is_filtered}, in a cluster only those are written
+def save_media_filters(guild_id, changes=None):
+    if cluster_bus is not None and changes is not None:
+        _pending_media_changes.setdefault(guild_id, {}).update(changes)
+        writer.schedule(
+            ("media_filters", guild_id),
+            lambda: _pending_media_changes.pop(guild_id, {}),
+            lambda data: _save_and_publish(store.apply_media_changes, guild_id, data),
+            _merge_changes
+        )
+        return
 
-# Get the path for a specific server's media filter settings
-def get_media_filter_path(guild_id):
-    return os.path.join(media_filter_DIR, f'media_filter_{guild_id}.json')
+    media_filters = guild_media_filters[guild_id]
+    writer.schedule(
+        ("media_filters", guild_id),
+        lambda: media_rules.from_masks(media_filters),
+        lambda data: _save_and_publish(store.save_media_filters, guild_id, data)
+    )
+
+# Queue the filter list of a server to be saved
+# In a cluster only the added and removed words are written, the latest change to a word wins
+def save_filter_list(guild_id, added=(), removed=()):
+    if cluster_bus is not None and (added or removed):
+        changes = _pending_word_changes.setdefault(guild_id, {})
+        changes.update(dict.fromkeys(removed, False))
+        changes.update(dict.fromkeys(added, True))
+        writer.schedule(
+            ("filter_list", guild_id),
+            lambda: _pending_word_changes.pop(guild_id, {}),
+            lambda data: _save_and_publish(_apply_word_changes, guild_id, data),
+            _merge_changes
+        )
+        return
 
-# Get the path for a specific server's filter list
-def get_filter_path(guild_id):
-    return os.path.join(FILTER_DIR, f'filter_list_{guild_id}.json')
+    filter_list = guild_filter_lists[guild_id]
+    writer.schedule(
+        ("filter_list", guild_id),
+        lambda: list(filter_list),
+        lambda data: _save_and_publish(store.save_filter_list, guild_id, data)
+    )
 
-# Load or create the media filter settings for a specific server
-def load_media_filters(guild_id):
-    file_path = get_media_filter_path(guild_id)
-    
-    try:
-        with open(file_path, 'r') as f:
-            media_filters = json.load(f)
-            print(f"Media filter settings for server {guild_id} loaded successfully.\n")
+# Changes that failed to save are retried together with the ones made since, the newer change to an item wins
+def _merge_changes(older, newer):
+    return {**older, **newer}
 
-    except (FileNotFoundError, json.JSONDecodeError):
-        print(f"Media filter settings for server {guild_id} not found or corrupted. Creating new settings.\n")
-        # Default structure: {channel_id: {media_type: is_filtered}}
-        media_filters = {}
+def _apply_word_changes(guild_id, changes):
+    added = [word for word, is_added in changes.items() if is_added]
+    removed = [word for word, is_added in changes.items() if not is_added]
+    store.apply_filter_changes(guild_id, added, removed)
 
-        with open(file_path, 'w') as f:
-            json.dump(media_filters, f, indent=2)
+# Save a change, then tell the other cluster workers to drop their copy of the server
+def _save_and_publish(save, guild_id, data):
+    save(guild_id, data)
 
-    return media_filters
+    if cluster_bus is not None:
+        cluster_bus.publish(guild_id)
+
+# Whether a server has a change that hasn't been written yet
+def _save_pending(guild_id):
+    return writer.is_pending(("filter_list", guild_id)) or writer.is_pending(("media_filters", guild_id))
+
+# Forget everything held in memory for a server, it is loaded again on its next message
+# With a change of ours still being saved, wait for it: reloading now would lose it from memory
+def invalidate_guild(guild_id):
+    _inactive_guilds.discard(guild_id)
+
+    if _save_pending(guild_id):
+        asyncio.get_running_loop().call_later(max(writer.delay, 0.1), invalidate_guild, guild_id)
+        return
+
+    guild_cache.discard(guild_id)
+    _drop_guild_state(guild_id)
+
+# Called by the guild cache, remember the server if there was nothing to filter in it
+def _evict_guild(guild_id):
+    entry = moderation_index.get(guild_id)
+    if entry is not None and not entry[0] and not entry[1]:
+        _inactive_guilds.add(guild_id)
+
+    _drop_guild_state(guild_id)
+
+def _drop_guild_state(guild_id):
+    moderation_index.pop(guild_id, None)
+    guild_filter_lists.pop(guild_id, None)
+    guild_media_filters.pop(guild_id, None)
+    guild_word_matchers.pop(guild_id, None)
+    guild_filter_versions.pop(guild_id, None)
+
+# Write any settings that are still waiting to be saved, and carry out queued moderation actions
+async def flush():
+    await action_queue.flush()
+    await writer.flush()
+
+
+# Recompute a server's entry in the moderation index, call after any change to its settings
+def update_moderation_index(guild_id):
+    guild_filter_versions[guild_id] = next(_filter_version_counter)
+    _inactive_guilds.discard(guild_id)
+    has_words = bool(guild_filter_lists.get(guild_id))
+    moderation_index[guild_id] = (has_words, guild_media_filters.setdefault(guild_id, {}))
+
+# Cheap check run for every message, False means nothing in this channel can be filtered
+def needs_filtering(guild_id, channel_id):
+    entry = moderation_index.get(guild_id)
+
+    # Not loaded yet, let the filter pipeline load it unless it had nothing to filter when it was dropped
+    if entry is None:
+        return guild_id not in _inactive_guilds
+
+    return entry[0] or channel_id in entry[1]
+
+# Check whether a server's settings are already in memory
+def is_guild_loaded(guild_id):
+    return guild_id in moderation_index
+
+# Read and compile the settings of several servers, runs on a worker thread
+def _load_guild_batch(guild_ids):
+    filter_lists = store.load_filter_lists(guild_ids)
+    media_filters = store.load_many_media_filters(guild_ids)
+
+    loaded = {}
+    for guild_id in guild_ids:
+        filter_list = filter_lists.get(guild_id, [])
+        masks = media_rules.to_masks(media_filters.get(guild_id, {}))
+        loaded[guild_id] = (filter_list, masks, WordMatcher(filter_list).compile())
+
+    return loaded
+
+# Load a batch of servers off the event loop, anyone asking for one of them waits on this load
+async def _load_guilds(guild_ids, limiter=None):
+    loop = asyncio.get_running_loop()
+    futures = {}
+
+    for guild_id in guild_ids:
+        future = loop.create_future()
+        _guild_loads[guild_id] = future
+        futures[guild_id] = future
 
-# Load or create the filter list for a specific server
-def load_filter_list(guild_id):
-    file_path = get_filter_path(guild_id)
-    
     try:
-        with open(file_path, 'r') as f:
-            filter_list = json.load(f)
-            print(f"Filter list for server {guild_id} loaded successfully.\n")
+        if limiter is None:
+            loaded = await asyncio.to_thread(_load_guild_batch, guild_ids)
+        else:
+            async with limiter:
+                loaded = await asyncio.to_thread(_load_guild_batch, guild_ids)
+
+        for guild_id, (filter_list, media_filters, matcher) in loaded.items():
+            # Keep anything a command put in memory while the batch was loading
+            guild_filter_lists.setdefault(guild_id, filter_list)
+            guild_media_filters.setdefault(guild_id, media_filters)
+            if guild_filter_lists[guild_id] is filter_list:
+                guild_word_matchers.setdefault(guild_id, matcher)
+            else:
+                get_word_matcher(guild_id)
+
+            update_moderation_index(guild_id)
+
+        # Only once the whole batch is in place, so the servers of this batch can't evict each other mid-install
+        for guild_id in loaded:
+            guild_cache.touch(guild_id)
+
+        for future in futures.values():
+            future.set_result(None)
+
+    except BaseException as error:
+        for future in futures.values():
+            if isinstance(error, Exception):
+                future.set_exception(error)
+                future.exception()
+            else:
+                future.cancel()
+        raise
+
+    finally:
+        for guild_id in guild_ids:
+            if _guild_loads.get(guild_id) is futures[guild_id]:
+                del _guild_loads[guild_id]
+
+# Make sure a server's settings are in memory, without blocking the event loop
+# A server can be evicted again while waiting on a load, so check until it's really in memory
+async def ensure_guild_loaded(guild_id):
+    while not is_guild_loaded(guild_id):
+        # Wait for the load that is already running instead of starting another one
+        future = _guild_loads.get(guild_id)
+        if future is not None:
+            await asyncio.shield(future)
+        else:
+            await _load_guilds([guild_id])
 
-    except (FileNotFoundError, json.JSONDecodeError):
-        print(f"Filter list for server {guild_id} not found or corrupted. Creating a new one.\n")
-        filter_list = []
+    # Touching it last means nothing can evict it before the caller uses it
+    guild_cache.touch(guild_id)
 
-        with open(file_path, 'w') as f:
-            json.dump(filter_list, f, indent=2)
+# Load and compile the settings of every server at once, a few batches at a time
+async def warm_up(guild_ids, concurrency=WARMUP_CONCURRENCY, batch_size=WARMUP_BATCH_SIZE):
+    start_time = time.perf_counter()
 
-    return filter_list
+    pending = [guild_id for guild_id in guild_ids if not is_guild_loaded(guild_id) and guild_id not in _guild_loads]
+
+    # Loading more servers than the cache keeps would only evict them again straight away
+    if guild_cache.max_guilds > 0:
+        pending = pending[:max(guild_cache.max_guilds - len(guild_cache), 0)]
+    batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+    limiter = asyncio.Semaphore(concurrency)
+
+    results = await asyncio.gather(*(_load_guilds(batch, limiter) for batch in batches), return_exceptions=True)
+
+    failed = [result for result in results if isinstance(result, Exception)]
+    for error in failed:
+        print(f"Failed to warm up moderation settings: {error}")
+
+    elapsed = (time.perf_counter() - start_time) * 1000
+    print(f"Warmed up moderation settings for {len(pending)} servers in {elapsed:.0f} ms ({len(failed)} failed batches).\n")
+
+# Start warming up in the background if it is enabled, safe to call on every reconnect
+def start_warm_up(guild_ids):
+    global _warmup_task
+
+    if not WARMUP_ENABLED or (_warmup_task is not None and not _warmup_task.done()):
+        return
+
+    _warmup_task = asyncio.create_task(warm_up(guild_ids))
+
+
+# Get or build the compiled word matcher for a specific server
+def get_word_matcher(guild_id):
+    matcher = guild_word_matchers.get(guild_id)
+
+    if matcher is None:
+        if guild_id not in guild_filter_lists:
+            guild_filter_lists[guild_id] = load_filter_list(guild_id)
+
+        matcher = WordMatcher(guild_filter_lists[guild_id])
+        guild_word_matchers[guild_id] = matcher
+
+    return matcher
 
 
 # Set up moderation commands
@@ -100,25 +360,28 @@ def setup_moderation_commands(moderation_group, client):
         # Get or load media filter settings for this server
         guild_id = interaction.guild.id
 
-        if guild_id not in guild_media_filters:
-            guild_media_filters[guild_id] = load_media_filters(guild_id)
+        await ensure_guild_loaded(guild_id)
         
         media_filters = guild_media_filters[guild_id]
-        
-        # Convert channel ID to string for JSON compatibility
-        channel_id = str(interaction.channel.id)
-        
-        # Initialize channel settings if needed
-        if channel_id not in media_filters:
-            media_filters[channel_id] = {}
+        channel_id = interaction.channel.id
         
         # Set the filter status
         is_filtered = action.lower() == "on"
-        media_filters[channel_id][media_type] = is_filtered
+        mask = media_filters.get(channel_id, 0)
+
+        if is_filtered:
+            mask |= MEDIA_FLAGS[media_type]
+        else:
+            mask &= ~MEDIA_FLAGS[media_type]
+
+        if mask:
+            media_filters[channel_id] = mask
+        else:
+            media_filters.pop(channel_id, None)
         
         # Save the settings
-        with open(get_media_filter_path(guild_id), 'w') as f:
-            json.dump(media_filters, f, indent=2)
+        save_media_filters(guild_id, {(channel_id, media_type): is_filtered})
+        update_moderation_index(guild_id)
         
         status = "enabled" if is_filtered else "disabled"
         await interaction.response.send_message(f"{media_type.capitalize()} filtering has been {status} in this channel.", ephemeral=False)
@@ -129,13 +392,9 @@ def setup_moderation_commands(moderation_group, client):
         # Get or load media filter settings for this server
         guild_id = interaction.guild.id
 
-        if guild_id not in guild_media_filters:
-            guild_media_filters[guild_id] = load_media_filters(guild_id)
-        
-        media_filters = guild_media_filters[guild_id]
+        await ensure_guild_loaded(guild_id)
         
-        # Convert channel ID to string for JSON compatibility
-        channel_id = str(interaction.channel.id)
+        mask = guild_media_filters[guild_id].get(interaction.channel.id, 0)
         
         embed = discord.Embed(
             title=f"Media Filter Status for #{interaction.channel.name}",
@@ -144,12 +403,12 @@ def setup_moderation_commands(moderation_group, client):
             timestamp=discord.utils.utcnow()
         )
         
-        if channel_id not in media_filters:
+        if not mask:
             status_text = "No media filters are active in this channel."
         else:
             status_lines = []
             for media_type in MEDIA_TYPES:
-                is_filtered = media_filters[channel_id].get(media_type, False)
+                is_filtered = bool(mask & MEDIA_FLAGS[media_type])
                 status = "🟢 Allowed" if not is_filtered else "🔴 Filtered"
                 status_lines.append(f"**{media_type.capitalize()}**: {status}")
             status_text = "\n".join(status_lines)
@@ -174,8 +433,7 @@ def setup_moderation_commands(moderation_group, client):
 
         # Get or load the filter list for this server
         guild_id = interaction.guild.id
-        if guild_id not in guild_filter_lists:
-            guild_filter_lists[guild_id] = load_filter_list(guild_id)
+        await ensure_guild_loaded(guild_id)
         
         current_filter_list = guild_filter_lists[guild_id]
         
@@ -185,8 +443,10 @@ def setup_moderation_commands(moderation_group, client):
             return
         
         current_filter_list.append(word.lower())
-        with open(get_filter_path(guild_id), 'w') as f:
-            json.dump(current_filter_list, f, indent=2)
+        get_word_matcher(guild_id).add(word.lower())
+
+        save_filter_list(guild_id, added=[word.lower()])
+        update_moderation_index(guild_id)
         
         await interaction.response.send_message(f"Added '{word}' to the filter list.", ephemeral=True)
 
@@ -204,8 +464,7 @@ def setup_moderation_commands(moderation_group, client):
 
         # Get or load the filter list for this server
         guild_id = interaction.guild.id
-        if guild_id not in guild_filter_lists:
-            guild_filter_lists[guild_id] = load_filter_list(guild_id)
+        await ensure_guild_loaded(guild_id)
         
         current_filter_list = guild_filter_lists[guild_id]
         
@@ -220,9 +479,10 @@ def setup_moderation_commands(moderation_group, client):
         # Remove the word
         for match in matching_words:
             current_filter_list.remove(match)
+            get_word_matcher(guild_id).remove(match)
         
-        with open(get_filter_path(guild_id), 'w') as f:
-            json.dump(current_filter_list, f, indent=2)
+        save_filter_list(guild_id, removed=matching_words)
+        update_moderation_index(guild_id)
         
         await interaction.response.send_message(f"Removed '{word}' from the filter list.", ephemeral=True)
 
@@ -239,8 +499,7 @@ def setup_moderation_commands(moderation_group, client):
 
         # Get or load the filter list for this server
         guild_id = interaction.guild.id
-        if guild_id not in guild_filter_lists:
-            guild_filter_lists[guild_id] = load_filter_list(guild_id)
+        await ensure_guild_loaded(guild_id)
         
         current_filter_list = guild_filter_lists[guild_id]
 
@@ -274,98 +533,95 @@ async def on_message_filter(message, client):
     # Load media filter settings for this server if needed
     guild_id = message.guild.id
 
-    if guild_id not in guild_media_filters:
-        guild_media_filters[guild_id] = load_media_filters(guild_id)
-    
-    media_filters = guild_media_filters[guild_id]
+    await ensure_guild_loaded(guild_id)
+
+    global messages_scanned
+    messages_scanned += 1
+
+    with timed("filter scan"):
+        await scan_message(message, guild_id)
+
+# Check a message against its server's media rules and banned words
+async def scan_message(message, guild_id):
+    has_words, media_masks = moderation_index[guild_id]
     
-    # Skip if no filter settings for this channel
-    channel_id = str(message.channel.id)
+    # Media rules for this channel, 0 if there are none
+    channel_mask = media_masks.get(message.channel.id, 0)
 
-    if channel_id not in media_filters:
+    if scan_pool.enabled:
+        # Let a worker process do the scanning, only the verdict comes back
+        await scan_in_pool(message, guild_id, has_words, channel_mask)
+        return
+
+    # Skip media checks if no media rules are on in this channel
+    if not channel_mask:
         # Continue with word filtering
-        await handle_word_filtering(message)
+        if has_words:
+            await handle_word_filtering(message)
         return
     
-    channel_settings = media_filters[channel_id]
-    
-    # Check for various media types
-    should_delete = False
-    filtered_types = []
-    
-    # Check for images
-    if channel_settings.get('images', False) and message.attachments:
-        for attachment in message.attachments:
-            if attachment.content_type and attachment.content_type.startswith('image/'):
-                should_delete = True
-                filtered_types.append('images')
-                break
-    
-    # Check for videos
-    if channel_settings.get('videos', False) and message.attachments:
-        for attachment in message.attachments:
-            if attachment.content_type and attachment.content_type.startswith('video/'):
-                should_delete = True
-                filtered_types.append('videos')
-                break
-    
-    # Check for links
-    if channel_settings.get('links', False) and any(url in message.content for url in ['http://', 'https://']):
-        should_delete = True
-        filtered_types.append('links')
-    
-    # Check for files
-    if channel_settings.get('files', False) and message.attachments:
-        for attachment in message.attachments:
-            if not (attachment.content_type and (attachment.content_type.startswith('image/') or attachment.content_type.startswith('video/'))):
-                should_delete = True
-                filtered_types.append('files')
-                break
-    
-    # Check for embeds
-    if channel_settings.get('embeds', False) and message.embeds:
-        should_delete = True
-        filtered_types.append('embeds')
+    # Classify the message in one pass and check it against the channel's rules
+    found = media_rules.classify(message, channel_mask)
     
     # Delete the message if it contains filtered media
-    if should_delete:
-        try:
-            await message.delete()
-            print(f"Server {guild_id}, Channel {channel_id}: Deleted message containing filtered media types: {', '.join(filtered_types)}")
-            
-            # Notify the user
-            types_str = ', '.join(filtered_types)
-            await message.channel.send(
-                f"{message.author.mention}, your message was deleted because {types_str} are not allowed in this channel.", 
-                delete_after=10
-            )
-        except Exception as error:
-            print(f"Failed to delete message or send notification: {error}")
-    else:
+    if found:
+        remove_for_media(message, found)
+    elif has_words:
         # Continue with word filtering if media filtering didn't trigger
         await handle_word_filtering(message)
 
+# Queue a message for deletion because of the media types it contains
+def remove_for_media(message, found):
+    filtered_types = media_rules.describe(found)
+    print(f"Server {message.guild.id}, Channel {message.channel.id}: Deleting message containing filtered media types: {', '.join(filtered_types)}")
+        
+    # Delete and notify the user, batched with other actions in this channel
+    messages_deleted["media"] += 1
+    types_str = ', '.join(filtered_types)
+    action_queue.submit(message, f"your message was deleted because {types_str} are not allowed in this channel.")
+
+# Queue a message for deletion because of the banned words it contains
+def remove_for_words(message, banned_words):
+    print(f"Server {message.guild.id}: Deleting message containing banned words: {', '.join(banned_words)}")
+
+    # Delete and notify the user, batched with other actions in this channel
+    messages_deleted["words"] += 1
+    action_queue.submit(message, f"your message was deleted for containing the following banned word/s: {', '.join(banned_words)}")
+
+# Run the media and word checks in the scan pool, then act on the verdict here
+async def scan_in_pool(message, guild_id, has_words, channel_mask):
+    if not has_words and not channel_mask:
+        return
+
+    version = guild_filter_versions[guild_id] if has_words else None
+    content_types = [attachment.content_type for attachment in message.attachments] if channel_mask else ()
+
+    # Hold on to the list now, the server may be evicted or invalidated while the worker is busy
+    filter_list = guild_filter_lists.get(guild_id, [])
+
+    found, banned_words = await scan_pool.scan(
+        guild_id,
+        version,
+        lambda: list(filter_list),
+        message.content,
+        content_types,
+        bool(message.embeds),
+        channel_mask
+    )
+
+    if found:
+        remove_for_media(message, found)
+    elif banned_words:
+        remove_for_words(message, banned_words)
+
 # Separate function to handle word filtering
 async def handle_word_filtering(message):
-    # Get or load the filter list for this server
+    # Get or build the compiled matcher for this server
     guild_id = message.guild.id
-    if guild_id not in guild_filter_lists:
-        guild_filter_lists[guild_id] = load_filter_list(guild_id)
-    
-    current_filter_list = guild_filter_lists[guild_id]
+    await ensure_guild_loaded(guild_id)
+    matcher = get_word_matcher(guild_id)
     
-    # Check for banned words
-    banned_words = [word for word in current_filter_list if word.lower() in message.content.lower()]
+    # Check for banned words in a single pass over the message
+    banned_words = matcher.find_all(message.content)
     if banned_words:
-        try:
-            await message.delete()
-            print(f"Server {guild_id}: Deleted message containing banned words: {', '.join(banned_words)}")
-        except Exception as error:
-            print(f"Failed to delete message: {error}")
-        try:
-            await message.channel.send(
-                f"{message.author.mention}, your message was deleted for containing the following banned word/s: {', '.join(banned_words)}", 
-                delete_after=10
-            )
-        except Exception as error:
-            print(f"Failed to send reply to offending user: {error}")
+        remove_for_words(message, banned_words)
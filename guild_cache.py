@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict, deque
+
+
+# Keeps track of which servers have their settings in memory, and drops the ones that aren't needed
+# Servers are evicted least recently used first once there are more than max_guilds, or after idle_ttl seconds unused
+# The state itself lives elsewhere: evict(guild_id) is called to forget it, and it's loaded again on next use
+class GuildCache:
+
+    def __init__(self, evict, max_guilds=5000, idle_ttl=3600, can_evict=None, clock=time.monotonic):
+        self.evict = evict
+        self.max_guilds = max_guilds
+        self.idle_ttl = idle_ttl
+        self.can_evict = can_evict
+        self.clock = clock
+
+        # guild_id -> last used, least recently used first
+        self._last_used = OrderedDict()
+        # When the evictions of the last minute happened, for the eviction rate
+        self._recent_evictions = deque()
+
+        self.evictions = 0
+        self.idle_evictions = 0
+
+    def __len__(self):
+        return len(self._last_used)
+
+    def __contains__(self, guild_id):
+        return guild_id in self._last_used
+
+    # Mark a server as just used, evicting others if needed
+    def touch(self, guild_id):
+        now = self.clock()
+        self._last_used[guild_id] = now
+        self._last_used.move_to_end(guild_id)
+        self._enforce(now, guild_id)
+
+    # Stop tracking a server whose state was dropped some other way
+    def discard(self, guild_id):
+        self._last_used.pop(guild_id, None)
+
+    # Evictions per minute
+    @property
+    def eviction_rate(self):
+        self._trim(self.clock())
+        return len(self._recent_evictions)
+
+    def _trim(self, now):
+        while self._recent_evictions and self._recent_evictions[0] <= now - 60:
+            self._recent_evictions.popleft()
+
+    # The server that was just used is never evicted, even if everything else is pinned
+    def _enforce(self, now, keep):
+        # Servers that can't be evicted right now are skipped, at most one pass over everything
+        for _ in range(len(self._last_used)):
+            guild_id, last_used = next(iter(self._last_used.items()))
+            if guild_id == keep:
+                return
+
+            over_size = self.max_guilds > 0 and len(self._last_used) > self.max_guilds
+            idle = self.idle_ttl > 0 and now - last_used >= self.idle_ttl
+            if not over_size and not idle:
+                return
+
+            if self.can_evict is not None and not self.can_evict(guild_id):
+                self._last_used.move_to_end(guild_id)
+                continue
+
+            del self._last_used[guild_id]
+            self.evict(guild_id)
+
+            self.evictions += 1
+            if idle and not over_size:
+                self.idle_evictions += 1
+            self._recent_evictions.append(now)
+            self._trim(now)
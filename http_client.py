@@ -0,0 +1,61 @@
+import aiohttp, os
+from urllib.parse import urlsplit
+from latency import timed
+
+
+# Shared session used by every command that talks to an external API
+_session = None
+
+
+# Open the pooled session, called once when the bot starts
+async def start():
+    global _session
+
+    if _session is not None and not _session.closed:
+        return _session
+
+    # Connection pool settings, can be overridden from the .env file
+    connector = aiohttp.TCPConnector(
+        limit=int(os.getenv("HTTP_POOL_SIZE", "50")),
+        limit_per_host=int(os.getenv("HTTP_POOL_SIZE_PER_HOST", "10")),
+        keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE", "30")),
+        ttl_dns_cache=300
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=float(os.getenv("HTTP_TIMEOUT", "10")),
+        sock_connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    )
+
+    _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    print("HTTP session has been opened\n")
+    return _session
+
+
+# Close the pooled session, called when the bot shuts down
+async def close():
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+        print("HTTP session has been closed\n")
+
+    _session = None
+
+
+# Get the shared session, opening it if the bot hasn't done so yet
+async def get_session():
+    if _session is None or _session.closed:
+        return await start()
+
+    return _session
+
+
+# Send a GET request and decode the JSON body
+async def get_json(url, params=None):
+    session = await get_session()
+
+    # Timed per API host, so a slow upstream stands out in /stats
+    with timed(f"upstream {urlsplit(url).hostname}"):
+        async with session.get(url, params=params) as response:
+            # Some APIs don't send a JSON content type, so don't enforce it
+            return await response.json(content_type=None)
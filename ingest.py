@@ -0,0 +1,113 @@
+import asyncio, time
+from collections import deque
+
+
+# Bounded queue between the gateway and the filter pipeline, served by a fixed pool of workers
+# Servers take turns, so one flooded server can't starve the others
+class IngestQueue:
+
+    def __init__(self, handler, workers=4, max_size=2000, max_per_guild=200, notice_shed_at=0.5, on_pressure=None):
+        # handler(message) is the coroutine run for every queued message
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.max_per_guild = max_per_guild
+
+        # Once the queue is this full, on_pressure(True) is called so cheaper work can be dropped first
+        # 0 turns it off
+        self.notice_shed_at = int(max_size * notice_shed_at) if notice_shed_at else None
+        self.on_pressure = on_pressure
+        self.under_pressure = False
+
+        # guild_id -> messages waiting for that server
+        self._queues = {}
+        # Servers with waiting messages, in the order they get served
+        self._ready = deque()
+        # Counts waiting messages, so each one wakes exactly one worker
+        self._available = asyncio.Semaphore(0)
+        self._tasks = []
+
+        self.depth = 0
+        self.max_depth_seen = 0
+        self.processed = 0
+        self.shed = 0
+        self.errors = 0
+
+    # Start the worker pool
+    def start(self):
+        if self._tasks:
+            return
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    # Stop the workers, giving them a moment to finish what is still waiting
+    async def stop(self, drain_timeout=5):
+        deadline = time.monotonic() + drain_timeout
+        while self.depth and self._tasks and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _set_pressure(self):
+        if self.notice_shed_at is None:
+            return
+
+        under_pressure = self.depth >= self.notice_shed_at
+        if under_pressure != self.under_pressure:
+            self.under_pressure = under_pressure
+            if self.on_pressure is not None:
+                self.on_pressure(under_pressure)
+
+    # Queue a message, returns False if it was shed because the queue or its server's share is full
+    def submit(self, guild_id, message):
+        queue = self._queues.get(guild_id)
+
+        if self.depth >= self.max_size or (queue is not None and len(queue) >= self.max_per_guild):
+            self.shed += 1
+            return False
+
+        if queue is None:
+            queue = deque()
+            self._queues[guild_id] = queue
+            self._ready.append(guild_id)
+
+        queue.append(message)
+        self.depth += 1
+        self.max_depth_seen = max(self.max_depth_seen, self.depth)
+        self._set_pressure()
+
+        self._available.release()
+        return True
+
+    # Take the next message, one per server in turn
+    def _next(self):
+        guild_id = self._ready.popleft()
+        queue = self._queues[guild_id]
+        message = queue.popleft()
+
+        if queue:
+            self._ready.append(guild_id)
+        else:
+            del self._queues[guild_id]
+
+        self.depth -= 1
+        self._set_pressure()
+        return message
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            message = self._next()
+
+            try:
+                await self.handler(message)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.errors += 1
+                print(f"Failed to filter message: {error}")
@@ -0,0 +1,77 @@
+import asyncio
+from collections import deque
+
+
+# Keeps a few jokes ready so /joke can answer without waiting on JokeAPI
+class JokeBuffer:
+
+    def __init__(self, fetch_batch, size=20, low_water=5, batch_size=10, retry_delay=30):
+        # fetch_batch(amount) is a coroutine function returning a list of jokes
+        self.fetch_batch = fetch_batch
+        self.size = size
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+
+        self._jokes = deque(maxlen=size)
+        self._wake = asyncio.Event()
+        self._task = None
+
+        self.served = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._jokes)
+
+    # Start the background refill task
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wake.set()
+            self._task = asyncio.create_task(self._refill_loop())
+
+    # Stop the background refill task
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # Take a joke from the buffer, or None if it ran dry
+    def pop(self):
+        if not self._jokes:
+            self.misses += 1
+            self._wake.set()
+            return None
+
+        joke = self._jokes.popleft()
+        self.served += 1
+
+        if len(self._jokes) <= self.low_water:
+            self._wake.set()
+
+        return joke
+
+    async def _refill_loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+
+            while len(self._jokes) < self.size:
+                amount = min(self.batch_size, self.size - len(self._jokes))
+
+                try:
+                    jokes = await self.fetch_batch(amount)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    print(f"Failed to prefetch jokes: {error}")
+                    await asyncio.sleep(self.retry_delay)
+                    continue
+
+                if not jokes:
+                    break
+
+                self._jokes.extend(jokes)
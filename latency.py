@@ -0,0 +1,112 @@
+import asyncio, bisect, time
+from contextlib import contextmanager
+
+
+# Upper bounds of the histogram buckets in seconds, from 0.1 ms to about two minutes, each 20% wider than the last
+# Percentiles are read from these bounds, so they are at most 20% too high
+BUCKETS = []
+_bound = 0.0001
+while _bound < 120:
+    BUCKETS.append(_bound)
+    _bound *= 1.2
+BUCKETS.append(float("inf"))
+
+
+# Latencies of one command or stage, kept as counts per bucket so recording is cheap and memory is fixed
+class LatencyHistogram:
+
+    __slots__ = ("counts", "count", "total", "errors", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.max = 0.0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    # Latency below which `percent` percent of the calls finished, in seconds
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+
+        rank = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+
+# Histograms by name, one for every command and pipeline stage that has been timed
+class LatencyRecorder:
+
+    def __init__(self):
+        self.histograms = {}
+
+    def get(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.histograms[name] = histogram
+        return histogram
+
+    def observe(self, name, seconds, error=False):
+        self.get(name).observe(seconds, error)
+
+    # For failures that are handled inside a timed block and so never raise out of it
+    def count_error(self, name):
+        self.get(name).errors += 1
+
+    # Time the block inside `with`, counting it as an error if it raises
+    @contextmanager
+    def timed(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - started_at, error=True)
+            raise
+        self.observe(name, time.perf_counter() - started_at)
+
+
+# Measures how late the event loop wakes up a task that sleeps for a fixed interval
+# Anything blocking the loop shows up here, whatever command or event caused it
+class LoopLagMonitor:
+
+    def __init__(self, histogram, interval=0.5):
+        self.histogram = histogram
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.histogram.observe(max(time.perf_counter() - expected, 0.0))
+
+
+# Shared by the whole bot
+recorder = LatencyRecorder()
+timed = recorder.timed
+count_error = recorder.count_error
@@ -0,0 +1,89 @@
+# Media filter rules as bitmasks, one bit per media type
+
+
+# Media types that can be filtered
+MEDIA_TYPES = ['images', 'videos', 'links', 'files', 'embeds']
+
+IMAGES = 1 << 0
+VIDEOS = 1 << 1
+LINKS = 1 << 2
+FILES = 1 << 3
+EMBEDS = 1 << 4
+
+MEDIA_FLAGS = {
+    'images': IMAGES,
+    'videos': VIDEOS,
+    'links': LINKS,
+    'files': FILES,
+    'embeds': EMBEDS
+}
+
+ALL_MEDIA = IMAGES | VIDEOS | LINKS | FILES | EMBEDS
+ATTACHMENT_MEDIA = IMAGES | VIDEOS | FILES
+
+
+# Convert saved settings ({channel_id_str: {media_type: is_filtered}}) into {channel_id: mask}
+# Channels with nothing filtered are left out
+def to_masks(media_filters):
+    masks = {}
+
+    for channel_id, settings in media_filters.items():
+        mask = 0
+        for media_type, is_filtered in settings.items():
+            if is_filtered:
+                mask |= MEDIA_FLAGS.get(media_type, 0)
+
+        if mask:
+            masks[int(channel_id)] = mask
+
+    return masks
+
+
+# Convert {channel_id: mask} back into the saved format
+def from_masks(masks):
+    return {
+        str(channel_id): {media_type: bool(mask & flag) for media_type, flag in MEDIA_FLAGS.items()}
+        for channel_id, mask in masks.items()
+        if mask
+    }
+
+
+# Names of the media types set in a mask, in MEDIA_TYPES order
+def describe(mask):
+    return [media_type for media_type in MEDIA_TYPES if mask & MEDIA_FLAGS[media_type]]
+
+
+# Work out which media types a message contains, looking at each attachment once
+# Only the types in `wanted` are looked for, so unused checks are skipped
+def classify(message, wanted=ALL_MEDIA):
+    content_types = [attachment.content_type for attachment in message.attachments] if wanted & ATTACHMENT_MEDIA else ()
+    return classify_parts(content_types, message.content, bool(message.embeds), wanted)
+
+
+# Same as classify, from the plain pieces of a message so it can be sent to another process
+def classify_parts(content_types, content, has_embeds, wanted=ALL_MEDIA):
+    found = 0
+
+    if wanted & ATTACHMENT_MEDIA:
+        for content_type in content_types:
+            content_type = content_type or ""
+
+            if content_type.startswith('image/'):
+                found |= IMAGES
+            elif content_type.startswith('video/'):
+                found |= VIDEOS
+            else:
+                found |= FILES
+
+            # Nothing more to learn from the rest of the attachments
+            if found & wanted & ATTACHMENT_MEDIA == wanted & ATTACHMENT_MEDIA:
+                break
+
+    if wanted & LINKS:
+        if 'http://' in content or 'https://' in content:
+            found |= LINKS
+
+    if wanted & EMBEDS and has_embeds:
+        found |= EMBEDS
+
+    return found & wanted
@@ -0,0 +1,168 @@
+import asyncio, logging, os, threading
+import latency
+
+
+# Prometheus only needs a few bucket bounds, every 4th latency bucket is about twice as wide as the previous one
+EXPORTED_BUCKETS = set(range(0, len(latency.BUCKETS) - 1, 4)) | {len(latency.BUCKETS) - 1}
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Builds a page in the Prometheus text format, one HELP and TYPE line per metric followed by its samples
+class Exposition:
+
+    def __init__(self):
+        self.lines = []
+
+    def add(self, name, kind, help_text, samples):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    def add_histogram(self, name, help_text, histograms, label="name"):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+
+        for key, histogram in histograms:
+            # Bucket counts are cumulative in the exported format
+            seen = 0
+            for index, (bound, count) in enumerate(zip(latency.BUCKETS, histogram.counts)):
+                seen += count
+                if index in EXPORTED_BUCKETS:
+                    labels = _labels({label: key, "le": "+Inf" if bound == float("inf") else f"{bound:.6g}"})
+                    self.lines.append(f"{name}_bucket{labels} {seen}")
+
+            self.lines.append(f"{name}_sum{_labels({label: key})} {histogram.total!r}")
+            self.lines.append(f"{name}_count{_labels({label: key})} {histogram.count}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+# Everything worth watching, read on the event loop so nothing changes while it is collected
+def render(client):
+    import filter_module, psutil
+    import slash_commands as slash
+
+    page = Exposition()
+
+    page.add("angela_messages_scanned_total", "counter", "Messages checked by the filter",
+             [({}, filter_module.messages_scanned)])
+    page.add("angela_messages_deleted_total", "counter", "Messages deleted by the filter, by reason",
+             [({"reason": reason}, count) for reason, count in filter_module.messages_deleted.items()])
+
+    caches = {"ask": slash.ask_cache, "weather": slash.weather_cache}
+    page.add("angela_cache_hits_total", "counter", "Cache lookups answered from the cache",
+             [({"cache": name}, cache.hits) for name, cache in caches.items()])
+    page.add("angela_cache_misses_total", "counter", "Cache lookups that had to be loaded",
+             [({"cache": name}, cache.misses) for name, cache in caches.items()])
+    page.add("angela_cache_hit_ratio", "gauge", "Share of cache lookups answered from the cache",
+             [({"cache": name}, cache.hit_rate / 100) for name, cache in caches.items()])
+    page.add("angela_cache_entries", "gauge", "Entries held by each cache",
+             [({"cache": name}, len(cache)) for name, cache in caches.items()])
+
+    guild_cache = filter_module.guild_cache
+    page.add("angela_guilds_resident", "gauge", "Servers whose moderation settings are in memory",
+             [({}, len(guild_cache))])
+    page.add("angela_guild_evictions_total", "counter", "Servers dropped from memory, by reason",
+             [({"reason": "idle"}, guild_cache.idle_evictions),
+              ({"reason": "size"}, guild_cache.evictions - guild_cache.idle_evictions)])
+
+    ingest_queue = getattr(client, "ingest_queue", None)
+    depths = {"moderation": filter_module.action_queue.pending, "writes": filter_module.writer.pending}
+    if ingest_queue is not None:
+        depths["ingest"] = ingest_queue.depth
+    page.add("angela_queue_depth", "gauge", "Items waiting in each queue",
+             [({"queue": name}, depth) for name, depth in depths.items()])
+
+    if ingest_queue is not None:
+        page.add("angela_ingest_shed_total", "counter", "Messages dropped because the filter queue was full",
+                 [({}, ingest_queue.shed)])
+    page.add("angela_notices_shed_total", "counter", "Deletion notices dropped while the filter queue was under pressure",
+             [({}, filter_module.action_queue.notices_shed)])
+    page.add("angela_discord_api_calls_total", "counter", "Delete and notice calls made to Discord",
+             [({}, filter_module.action_queue.api_calls)])
+    page.add("angela_discord_api_calls_saved_total", "counter", "Discord calls avoided by batching",
+             [({}, filter_module.action_queue.api_calls_saved)])
+
+    histograms = sorted(latency.recorder.histograms.items())
+    page.add_histogram("angela_latency_seconds", "Latency of commands, filter stages and upstream APIs", histograms)
+    page.add("angela_errors_total", "counter", "Failures of commands, filter stages and upstream APIs",
+             [({"name": name}, histogram.errors) for name, histogram in histograms])
+
+    if client is not None:
+        latencies = getattr(client, "latencies", None) or [(client.shard_id or 0, client.latency)]
+        page.add("angela_gateway_latency_seconds", "gauge", "Websocket latency of each shard",
+                 [({"shard": shard_id}, shard_latency) for shard_id, shard_latency in latencies if shard_latency == shard_latency])
+
+    page.add("angela_memory_bytes", "gauge", "Resident memory of the bot process",
+             [({}, psutil.Process(os.getpid()).memory_info().rss)])
+
+    return page.text()
+
+
+# Serves /metrics from a thread next to the bot, the page itself is built on the bot's event loop
+class MetricsServer:
+
+    def __init__(self, client, host="127.0.0.1", port=9108, timeout=5):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self._server = None
+        self._thread = None
+
+    def start(self, loop):
+        # Flask is only imported when the endpoint is turned on
+        from flask import Flask, Response
+        from werkzeug.serving import make_server
+
+        app = Flask("angela-metrics")
+
+        # Don't log every scrape
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+        @app.route("/metrics")
+        def metrics():
+            future = asyncio.run_coroutine_threadsafe(self._render(), loop)
+            return Response(future.result(self.timeout), mimetype="text/plain; version=0.0.4")
+
+        self._server = make_server(self.host, self.port, app, threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        print(f"Metrics available at http://{self.host}:{self.port}/metrics\n")
+
+    async def _render(self):
+        return render(self.client)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+            self._thread = None
+
+    # Build the server from METRICS_PORT, None when the endpoint is off
+    # Cluster workers each take the next port up, worker 0 uses METRICS_PORT itself
+    @classmethod
+    def from_env(cls, client):
+        if not os.getenv("METRICS_PORT"):
+            return None
+
+        port = int(os.getenv("METRICS_PORT")) + int(os.getenv("CLUSTER_WORKER_ID", "0"))
+        return cls(client, os.getenv("METRICS_HOST", "127.0.0.1"), port)
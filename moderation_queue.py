@@ -0,0 +1,174 @@
+import asyncio, datetime
+import discord
+from ask_stream import DISCORD_MESSAGE_LIMIT
+from latency import timed, count_error
+
+
+# Discord only bulk-deletes messages younger than 14 days, keep a margin for clock drift
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+
+
+# Per-channel state waiting to be flushed
+class _ChannelBatch:
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.messages = []
+        # notice text -> mentions of the users it applies to, in arrival order
+        self.notices = {}
+        self.notice_count = 0
+
+
+# Collects moderation deletions and notices per channel and sends them in as few API calls as possible
+class ModerationQueue:
+
+    def __init__(self, window=1.0, max_batch=100, notice_ttl=10):
+        self.window = window
+        self.max_batch = min(max(max_batch, 2), 100)
+        self.notice_ttl = notice_ttl
+
+        # channel_id -> _ChannelBatch
+        self._batches = {}
+        # channel_id -> task flushing it after the window
+        self._tasks = {}
+
+        # While set, notices are skipped and only deletions go through
+        self.drop_notices = False
+
+        self.deletes_queued = 0
+        self.notices_queued = 0
+        self.notices_shed = 0
+        self.api_calls = 0
+        self.api_calls_saved = 0
+
+    @property
+    def pending(self):
+        return sum(len(batch.messages) for batch in self._batches.values())
+
+    # Queue a message for deletion, with an optional notice like "your message was deleted because ..."
+    # The notice is shown after the author's mention and merged with identical notices for other users
+    def submit(self, message, notice=None):
+        channel = message.channel
+        batch = self._batches.get(channel.id)
+
+        if batch is None:
+            batch = _ChannelBatch(channel)
+            self._batches[channel.id] = batch
+
+        batch.messages.append(message)
+        self.deletes_queued += 1
+
+        if notice is not None and self.drop_notices:
+            self.notices_shed += 1
+
+        elif notice is not None:
+            mentions = batch.notices.setdefault(notice, [])
+            if message.author.mention not in mentions:
+                mentions.append(message.author.mention)
+            batch.notice_count += 1
+            self.notices_queued += 1
+
+        # Wait for the window to collect more actions for this channel
+        if channel.id not in self._tasks:
+            self._tasks[channel.id] = asyncio.create_task(self._flush_later(channel.id))
+
+    # Turn notice shedding on or off, used when the bot falls behind on messages
+    def set_drop_notices(self, drop):
+        self.drop_notices = drop
+
+    async def _flush_later(self, channel_id):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._tasks.pop(channel_id, None)
+
+        await self._flush_channel(channel_id)
+
+    async def _flush_channel(self, channel_id):
+        batch = self._batches.pop(channel_id, None)
+        if batch is None:
+            return
+
+        with timed("delete"):
+            await self._delete(batch.channel, batch.messages)
+
+        with timed("notify"):
+            await self._notify(batch.channel, batch.notices, batch.notice_count)
+
+    async def _delete_one(self, message):
+        self.api_calls += 1
+        try:
+            await message.delete()
+        except discord.NotFound:
+            pass
+        except Exception as error:
+            count_error("delete")
+            print(f"Failed to delete message: {error}")
+
+    async def _delete(self, channel, messages):
+        cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+        recent = [message for message in messages if message.created_at > cutoff]
+        old = [message for message in messages if message.created_at <= cutoff]
+
+        bulk_delete = getattr(channel, "delete_messages", None)
+
+        for start in range(0, len(recent), self.max_batch):
+            chunk = recent[start:start + self.max_batch]
+
+            if len(chunk) < 2 or bulk_delete is None:
+                old.extend(chunk)
+                continue
+
+            self.api_calls += 1
+            try:
+                await bulk_delete(chunk)
+                self.api_calls_saved += len(chunk) - 1
+            except Exception as error:
+                # One bad message fails the whole bulk delete, so retry them one by one
+                count_error("delete")
+                print(f"Bulk delete of {len(chunk)} messages failed, deleting one by one: {error}")
+                old.extend(chunk)
+
+        for message in old:
+            await self._delete_one(message)
+
+    async def _notify(self, channel, notices, notice_count):
+        if not notices:
+            return
+
+        lines = [f"{', '.join(mentions)}, {notice}" for notice, mentions in notices.items()]
+        sent = 0
+
+        # One message for everyone, split only if it gets too long for Discord
+        content = ""
+        for line in lines:
+            if content and len(content) + 1 + len(line) > DISCORD_MESSAGE_LIMIT:
+                await self._send(channel, content)
+                sent += 1
+                content = ""
+            content = f"{content}\n{line}" if content else line[:DISCORD_MESSAGE_LIMIT]
+
+        await self._send(channel, content)
+        sent += 1
+
+        self.api_calls_saved += max(notice_count - sent, 0)
+
+    async def _send(self, channel, content):
+        self.api_calls += 1
+        try:
+            await channel.send(content, delete_after=self.notice_ttl)
+        except Exception as error:
+            count_error("notify")
+            print(f"Failed to send reply to offending users: {error}")
+
+    # Send everything that is still waiting, used on shutdown
+    async def flush(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        for channel_id in list(self._batches):
+            await self._flush_channel(channel_id)
@@ -0,0 +1,305 @@
+import os, re, sqlite3, sys, threading
+from persistence import atomic_write_json, read_json
+
+
+# How the moderation settings of each server are kept on disk
+# load_* methods return None when a server has nothing saved yet
+class ModerationStore:
+
+    def load_filter_list(self, guild_id):
+        raise NotImplementedError
+
+    def load_media_filters(self, guild_id):
+        raise NotImplementedError
+
+    def save_filter_list(self, guild_id, filter_list):
+        raise NotImplementedError
+
+    def save_media_filters(self, guild_id, media_filters):
+        raise NotImplementedError
+
+    # Servers that have anything saved
+    def guild_ids(self):
+        raise NotImplementedError
+
+    # Load the filter lists of many servers at once, missing ones are left out
+    def load_filter_lists(self, guild_ids):
+        filter_lists = {}
+        for guild_id in guild_ids:
+            filter_list = self.load_filter_list(guild_id)
+            if filter_list is not None:
+                filter_lists[guild_id] = filter_list
+        return filter_lists
+
+    # Load the media filter settings of many servers at once, missing ones are left out
+    def load_many_media_filters(self, guild_ids):
+        media_filters = {}
+        for guild_id in guild_ids:
+            settings = self.load_media_filters(guild_id)
+            if settings is not None:
+                media_filters[guild_id] = settings
+        return media_filters
+
+    # Apply added and removed words on top of what is stored, so processes saving the same server don't undo each other
+    def apply_filter_changes(self, guild_id, added, removed):
+        removed = set(removed)
+        filter_list = [word for word in self.load_filter_list(guild_id) or [] if word not in removed]
+        filter_list += [word for word in dict.fromkeys(added) if word not in filter_list]
+        self.save_filter_list(guild_id, filter_list)
+
+    # Apply {(channel_id, media_type): is_filtered} on top of what is stored
+    def apply_media_changes(self, guild_id, changes):
+        media_filters = self.load_media_filters(guild_id) or {}
+        for (channel_id, media_type), is_filtered in changes.items():
+            media_filters.setdefault(str(channel_id), {})[media_type] = is_filtered
+        self.save_media_filters(guild_id, media_filters)
+
+    def close(self):
+        pass
+
+
+# One JSON file per server and setting, fine for small installs
+class JSONStore(ModerationStore):
+
+    FILTER_FILE = re.compile(r'filter_list_(\d+)\.json$')
+    MEDIA_FILTER_FILE = re.compile(r'media_filter_(\d+)\.json$')
+
+    def __init__(self, filter_dir='filter_lists', media_filter_dir='media_filters'):
+        self.filter_dir = filter_dir
+        self.media_filter_dir = media_filter_dir
+
+    # Get the path for a specific server's filter list
+    def get_filter_path(self, guild_id):
+        return os.path.join(self.filter_dir, f'filter_list_{guild_id}.json')
+
+    # Get the path for a specific server's media filter settings
+    def get_media_filter_path(self, guild_id):
+        return os.path.join(self.media_filter_dir, f'media_filter_{guild_id}.json')
+
+    def load_filter_list(self, guild_id):
+        return read_json(self.get_filter_path(guild_id), None)
+
+    def load_media_filters(self, guild_id):
+        return read_json(self.get_media_filter_path(guild_id), None)
+
+    # The directories are only created by the first save, so starting the bot touches no files
+    def save_filter_list(self, guild_id, filter_list):
+        os.makedirs(self.filter_dir, exist_ok=True)
+        atomic_write_json(self.get_filter_path(guild_id), filter_list)
+
+    def save_media_filters(self, guild_id, media_filters):
+        os.makedirs(self.media_filter_dir, exist_ok=True)
+        atomic_write_json(self.get_media_filter_path(guild_id), media_filters)
+
+    def guild_ids(self):
+        guild_ids = set()
+        for directory, pattern in ((self.filter_dir, self.FILTER_FILE), (self.media_filter_dir, self.MEDIA_FILTER_FILE)):
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                match = pattern.match(name)
+                if match:
+                    guild_ids.add(int(match.group(1)))
+        return sorted(guild_ids)
+
+
+# Every server in one SQLite database, changes only touch the rows that differ
+class SQLiteStore(ModerationStore):
+
+    # SQLite limits how many parameters one statement can take
+    BATCH_SIZE = 500
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS filter_words (
+            id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            word TEXT NOT NULL,
+            UNIQUE (guild_id, word)
+        );
+        CREATE TABLE IF NOT EXISTS media_filters (
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            media_type TEXT NOT NULL,
+            enabled INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, channel_id, media_type)
+        );
+    """
+
+    def __init__(self, path='moderation.db'):
+        self.path = path
+
+        # Saves run on worker threads, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _batches(self, guild_ids):
+        guild_ids = list(guild_ids)
+        for start in range(0, len(guild_ids), self.BATCH_SIZE):
+            yield guild_ids[start:start + self.BATCH_SIZE]
+
+    def load_filter_list(self, guild_id):
+        return self.load_filter_lists([guild_id]).get(guild_id)
+
+    def load_media_filters(self, guild_id):
+        return self.load_many_media_filters([guild_id]).get(guild_id)
+
+    def load_filter_lists(self, guild_ids):
+        filter_lists = {}
+
+        with self._lock:
+            for batch in self._batches(guild_ids):
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT guild_id, word FROM filter_words WHERE guild_id IN ({placeholders}) ORDER BY id",
+                    batch
+                )
+                for guild_id, word in rows:
+                    filter_lists.setdefault(guild_id, []).append(word)
+
+        return filter_lists
+
+    def load_many_media_filters(self, guild_ids):
+        media_filters = {}
+
+        with self._lock:
+            for batch in self._batches(guild_ids):
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT guild_id, channel_id, media_type, enabled FROM media_filters WHERE guild_id IN ({placeholders})",
+                    batch
+                )
+                for guild_id, channel_id, media_type, enabled in rows:
+                    # Same shape as the JSON files: {channel_id_str: {media_type: is_filtered}}
+                    channel_settings = media_filters.setdefault(guild_id, {}).setdefault(str(channel_id), {})
+                    channel_settings[media_type] = bool(enabled)
+
+        return media_filters
+
+    def save_filter_list(self, guild_id, filter_list):
+        with self._lock:
+            stored = {word for (word,) in self._db.execute("SELECT word FROM filter_words WHERE guild_id = ?", (guild_id,))}
+            wanted = set(filter_list)
+
+            removed = [(guild_id, word) for word in stored - wanted]
+            # Keep the list order for new words, ids decide the order on load
+            added = [(guild_id, word) for word in dict.fromkeys(filter_list) if word not in stored]
+
+            if not removed and not added:
+                return
+
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany("DELETE FROM filter_words WHERE guild_id = ? AND word = ?", removed)
+                self._db.executemany("INSERT INTO filter_words (guild_id, word) VALUES (?, ?)", added)
+
+    def save_media_filters(self, guild_id, media_filters):
+        wanted = {
+            (int(channel_id), media_type): bool(enabled)
+            for channel_id, settings in media_filters.items()
+            for media_type, enabled in settings.items()
+        }
+
+        with self._lock:
+            stored = {
+                (channel_id, media_type): bool(enabled)
+                for channel_id, media_type, enabled in self._db.execute(
+                    "SELECT channel_id, media_type, enabled FROM media_filters WHERE guild_id = ?", (guild_id,)
+                )
+            }
+
+            removed = [(guild_id, channel_id, media_type) for (channel_id, media_type) in stored.keys() - wanted.keys()]
+            changed = [
+                (guild_id, channel_id, media_type, int(enabled))
+                for (channel_id, media_type), enabled in wanted.items()
+                if stored.get((channel_id, media_type)) != enabled
+            ]
+
+            if not removed and not changed:
+                return
+
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "DELETE FROM media_filters WHERE guild_id = ? AND channel_id = ? AND media_type = ?", removed
+                )
+                self._db.executemany(
+                    "INSERT INTO media_filters (guild_id, channel_id, media_type, enabled) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (guild_id, channel_id, media_type) DO UPDATE SET enabled = excluded.enabled",
+                    changed
+                )
+
+    def apply_filter_changes(self, guild_id, added, removed):
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "DELETE FROM filter_words WHERE guild_id = ? AND word = ?", [(guild_id, word) for word in removed]
+                )
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO filter_words (guild_id, word) VALUES (?, ?)",
+                    [(guild_id, word) for word in dict.fromkeys(added)]
+                )
+
+    def apply_media_changes(self, guild_id, changes):
+        with self._lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT INTO media_filters (guild_id, channel_id, media_type, enabled) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (guild_id, channel_id, media_type) DO UPDATE SET enabled = excluded.enabled",
+                    [(guild_id, int(channel_id), media_type, int(is_filtered)) for (channel_id, media_type), is_filtered in changes.items()]
+                )
+
+    def guild_ids(self):
+        with self._lock:
+            rows = self._db.execute("SELECT guild_id FROM filter_words UNION SELECT guild_id FROM media_filters")
+            return sorted(guild_id for (guild_id,) in rows)
+
+
+# Create the store picked in the .env file
+def open_store(backend=None):
+    backend = (backend or os.getenv("MODERATION_STORE", "json")).lower()
+
+    if backend == "sqlite":
+        return SQLiteStore(os.getenv("MODERATION_DB", "moderation.db"))
+    if backend == "json":
+        return JSONStore()
+
+    raise ValueError(f"Unknown moderation store: {backend}")
+
+
+# Copy every server's settings from one store to another, returns how many servers were copied
+def migrate(source, destination):
+    guild_ids = source.guild_ids()
+
+    for guild_id in guild_ids:
+        filter_list = source.load_filter_list(guild_id)
+        if filter_list is not None:
+            destination.save_filter_list(guild_id, filter_list)
+
+        media_filters = source.load_media_filters(guild_id)
+        if media_filters is not None:
+            destination.save_media_filters(guild_id, media_filters)
+
+    return len(guild_ids)
+
+
+# One-shot migration from the JSON folders to SQLite: py moderation_store.py [database path]
+if __name__ == '__main__':
+    database_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("MODERATION_DB", "moderation.db")
+
+    json_store = JSONStore()
+    sqlite_store = SQLiteStore(database_path)
+
+    try:
+        count = migrate(json_store, sqlite_store)
+        print(f"Migrated moderation settings for {count} servers into {database_path}.")
+    finally:
+        sqlite_store.close()
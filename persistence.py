@@ -0,0 +1,166 @@
+import asyncio, json, os, tempfile
+
+
+# Write JSON so readers only ever see the old file or the complete new one
+def atomic_write_json(path, data):
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, path)
+
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+# Read a JSON file, moving a corrupted one aside instead of losing it
+# Returns default if the file is missing or unreadable
+def read_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    except FileNotFoundError:
+        return default
+
+    except json.JSONDecodeError as error:
+        backup_path = f"{path}.corrupt"
+        print(f"{path} is corrupted ({error}), keeping a copy at {backup_path}.\n")
+        try:
+            os.replace(path, backup_path)
+        except OSError as move_error:
+            print(f"Failed to move {path} aside: {move_error}\n")
+        return default
+
+
+# Collects changes and saves each key at most once per delay, on a worker thread
+# A failed write is kept and retried with a growing delay, so a change is only dropped if it never saves
+class WriteBehind:
+
+    def __init__(self, delay=1.0, retry_delay=1.0, max_retry_delay=60.0):
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        # key -> (function returning the data to save, function saving it, function merging two snapshots), always the latest one
+        self._pending = {}
+        # key -> task that saves it
+        self._tasks = {}
+        # key -> data of a write that failed, waiting to be retried
+        self._failed = {}
+        self._flush_now = asyncio.Event()
+        self._flushing = False
+
+        self.scheduled = 0
+        self.writes = 0
+        self.failures = 0
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    # Whether a key still has a change waiting to be written, or being written right now
+    def is_pending(self, key):
+        return key in self._pending or key in self._tasks
+
+    # Mark a key as changed, snapshot is called right before saving to get the data
+    # write receives that data and runs on a worker thread, it defaults to an atomic JSON write to the key's path
+    # merge(older, newer) combines the data of a failed write with a newer change, by default the newer one wins
+    def schedule(self, key, snapshot, write=None, merge=None):
+        if write is None:
+            write = lambda data: atomic_write_json(key, data)
+        if merge is None:
+            merge = lambda older, newer: newer
+
+        self._pending[key] = (snapshot, write, merge)
+        self.scheduled += 1
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (e.g. a script), just write it now
+            self._write_now(key)
+            return
+
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    def _write_now(self, key):
+        snapshot, write, _ = self._pending.pop(key)
+        write(snapshot())
+        self.writes += 1
+
+    # Keep the data of a failed write, the next attempt merges it with whatever changed since
+    def _requeue(self, key, data, snapshot, write, merge):
+        self._failed[key] = data
+        self._pending.setdefault(key, (snapshot, write, merge))
+
+    async def _run(self, key):
+        failed_attempts = 0
+
+        try:
+            while key in self._pending:
+                # Let more changes pile up, unless a flush was requested, and wait longer after each failure
+                if failed_attempts:
+                    timeout = min(self.retry_delay * 2 ** (failed_attempts - 1), self.max_retry_delay)
+                else:
+                    timeout = self.delay
+
+                try:
+                    await asyncio.wait_for(self._flush_now.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+                # Take the snapshot on the loop, so the data can't change while it is being written
+                snapshot, write, merge = self._pending.pop(key)
+                data = snapshot()
+                if key in self._failed:
+                    data = merge(self._failed.pop(key), data)
+
+                try:
+                    await asyncio.to_thread(write, data)
+                    self.writes += 1
+                    failed_attempts = 0
+                except Exception as error:
+                    self.failures += 1
+                    failed_attempts += 1
+                    self._requeue(key, data, snapshot, write, merge)
+                    print(f"Failed to save {key}, retrying: {error}")
+
+                    # On shutdown there is no point waiting, flush() reports what is left
+                    if self._flushing:
+                        return
+        finally:
+            del self._tasks[key]
+
+    # Write everything that is still pending, used on shutdown
+    # Returns the keys that still couldn't be saved
+    async def flush(self):
+        # Changes left over by an earlier flush get another attempt
+        for key in self._pending:
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.create_task(self._run(key))
+
+        if self._tasks:
+            self._flushing = True
+            self._flush_now.set()
+            try:
+                await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            finally:
+                self._flush_now.clear()
+                self._flushing = False
+
+        # Every task made one last attempt above, whatever is left failed it
+        unsaved = list(self._pending)
+        if unsaved:
+            print(f"{len(unsaved)} changes could not be saved: {', '.join(str(key) for key in unsaved)}")
+        return unsaved
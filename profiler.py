@@ -0,0 +1,55 @@
+import asyncio, cProfile, io, pstats, time
+
+
+# Raised when a profile is requested while another one is still running
+class ProfilerBusy(Exception):
+    pass
+
+
+_running = False
+
+
+# Profile everything the event loop runs for up to `seconds`, or until `messages` more messages were filtered
+# message_count returns how many messages have been filtered so far, it's only checked when messages > 0
+# Nothing is hooked into the interpreter outside this window, so the bot runs at full speed otherwise
+async def profile_window(seconds, messages=0, message_count=None, top=25, sort="cumulative", poll_interval=0.1):
+    global _running
+
+    if _running:
+        raise ProfilerBusy("A profile is already being recorded.")
+
+    _running = True
+    profiler = cProfile.Profile()
+    started_at = time.perf_counter()
+    first_message = message_count() if messages and message_count else 0
+
+    try:
+        profiler.enable()
+        try:
+            while time.perf_counter() - started_at < seconds:
+                if messages and message_count and message_count() - first_message >= messages:
+                    break
+                await asyncio.sleep(poll_interval)
+        finally:
+            profiler.disable()
+    finally:
+        _running = False
+
+    elapsed = time.perf_counter() - started_at
+    seen = message_count() - first_message if messages and message_count else None
+
+    # pstats sorting and formatting can take a moment on a busy profile, so do it off the loop
+    return await asyncio.to_thread(_report, profiler, elapsed, seen, top, sort)
+
+
+def _report(profiler, elapsed, messages, top, sort):
+    output = io.StringIO()
+    header = f"Profiled {elapsed:.1f}s"
+    if messages is not None:
+        header += f", {messages} messages filtered"
+    output.write(f"{header}\n\n")
+
+    stats = pstats.Stats(profiler, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+    return output.getvalue()
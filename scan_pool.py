@@ -0,0 +1,91 @@
+import asyncio, multiprocessing, os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from word_matcher import WordMatcher
+import media_rules
+
+
+# Returned by a worker that doesn't have the current word list of a server yet
+NEED_WORDS = "need_words"
+
+# Compiled matchers held by each worker process: guild_id -> (version, WordMatcher), least recently used first
+# Bounded like the servers kept by the bot itself, workers inherit GUILD_CACHE_SIZE from its environment
+_worker_matchers = OrderedDict()
+MAX_WORKER_MATCHERS = int(os.getenv("GUILD_CACHE_SIZE", "5000"))
+
+
+# Runs in a worker process: check one message and return only the verdict
+# words is None unless the worker asked for them, version None means the server has no banned words
+def _scan(guild_id, version, words, content, content_types, has_embeds, channel_mask):
+    if channel_mask:
+        found = media_rules.classify_parts(content_types, content, has_embeds, channel_mask)
+        if found:
+            return found, []
+
+    if version is None:
+        return 0, []
+
+    cached = _worker_matchers.get(guild_id)
+
+    if cached is None or cached[0] != version:
+        if words is None:
+            return NEED_WORDS
+
+        cached = (version, WordMatcher(words).compile())
+        _worker_matchers[guild_id] = cached
+
+        while MAX_WORKER_MATCHERS > 0 and len(_worker_matchers) > MAX_WORKER_MATCHERS:
+            _worker_matchers.popitem(last=False)
+
+    _worker_matchers.move_to_end(guild_id)
+    return 0, cached[1].find_all(content)
+
+
+# Optional pool of processes doing the CPU-heavy part of filtering, so scans don't hold up the event loop
+class ScanPool:
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._executor = None
+
+        self.scans = 0
+        self.word_lists_sent = 0
+
+    @property
+    def enabled(self):
+        return self.processes > 0
+
+    # Start every worker right away, call it before the bot starts any thread
+    # Forking a process that has threads can deadlock the child, and spawn or forkserver would make
+    # every worker run Angela.py again, so the workers are forked while the bot is still single-threaded
+    def start(self):
+        if self.enabled and self._executor is None:
+            start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context(start_method))
+
+            # With fork, the first task launches all the workers at once
+            self._executor.submit(int).result()
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # Scan a message in a worker, returns (media mask found, banned words found)
+    # get_words is only called when the worker doesn't have this version of the list compiled yet
+    async def scan(self, guild_id, version, get_words, content, content_types, has_embeds, channel_mask):
+        self.start()
+        loop = asyncio.get_running_loop()
+        self.scans += 1
+
+        verdict = await loop.run_in_executor(
+            self._executor, _scan, guild_id, version, None, content, content_types, has_embeds, channel_mask
+        )
+
+        if verdict == NEED_WORDS:
+            self.word_lists_sent += 1
+            verdict = await loop.run_in_executor(
+                self._executor, _scan, guild_id, version, get_words(), content, content_types, has_embeds, channel_mask
+            )
+
+        return verdict
@@ -0,0 +1,48 @@
+import time
+from collections import deque
+
+
+# Counts events per shard over a sliding window, one bucket per second
+class ShardMetrics:
+
+    def __init__(self, window=60, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+
+        # shard_id -> deque of [second, count]
+        self._buckets = {}
+        # shard_id -> events since start
+        self.totals = {}
+
+    def _trim(self, buckets, now):
+        while buckets and buckets[0][0] <= now - self.window:
+            buckets.popleft()
+
+    # Count one event for a shard
+    def record(self, shard_id):
+        now = int(self.clock())
+        buckets = self._buckets.get(shard_id)
+
+        if buckets is None:
+            buckets = deque()
+            self._buckets[shard_id] = buckets
+
+        if buckets and buckets[-1][0] == now:
+            buckets[-1][1] += 1
+        else:
+            buckets.append([now, 1])
+            self._trim(buckets, now)
+
+        self.totals[shard_id] = self.totals.get(shard_id, 0) + 1
+
+    # Events per second for a shard over the window
+    def rate(self, shard_id):
+        buckets = self._buckets.get(shard_id)
+        if not buckets:
+            return 0.0
+
+        self._trim(buckets, int(self.clock()))
+        return sum(count for _, count in buckets) / self.window
+
+    def shard_ids(self):
+        return sorted(self._buckets)
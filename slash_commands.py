@@ -1,10 +1,49 @@
-import discord, asyncio, datetime, requests, os, random, psutil, time
+import discord, asyncio, datetime, io, os, random, sys, time
+import http_client, ask_stream, filter_module, latency, profiler
 from typing import Optional, Dict
-from dotenv import load_dotenv
+from concurrency import ConcurrencyLimiter, LimiterBusy
+from cache import TTLCache
+from exchange_rates import RateTable, RateFetchError
+from joke_buffer import JokeBuffer
 
 
-# Load environment variables to ensure they're available
-load_dotenv()
+# Limits on how many /ask requests are sent to OpenAI at once, and how long the rest may wait
+ask_limiter = ConcurrencyLimiter(
+    max_concurrent=int(os.getenv("ASK_MAX_CONCURRENT", "4")),
+    max_per_guild=int(os.getenv("ASK_MAX_CONCURRENT_PER_GUILD", "2")),
+    max_queue=int(os.getenv("ASK_MAX_QUEUE", "20")),
+    max_wait=float(os.getenv("ASK_QUEUE_TIMEOUT", "20"))
+)
+
+ASK_BUSY_MESSAGE = "I'm answering too many questions right now, please try again in a minute."
+
+# Model and instructions used for /ask
+ASK_MODEL = "gpt-4o"
+ASK_SYSTEM_PROMPT = "You are a helpful assistant. Avoid using emojis and do not use more than 2k characters. Instead of writing a list, structure your response in a paragraph like you're personally talking to someone."
+
+# Stream /ask answers into the channel as they are generated, editing at most once per interval
+ASK_STREAM = os.getenv("ASK_STREAM", "1") == "1"
+ASK_STREAM_EDIT_INTERVAL = float(os.getenv("ASK_STREAM_EDIT_INTERVAL", "1.5"))
+
+# Memory taken by one cached answer: the key tuple, the question in it and the answer
+# The model and system prompt in the key are shared by every entry, so they aren't counted
+def ask_cache_sizeof(key, answer):
+    return sys.getsizeof(key) + sys.getsizeof(key[2]) + sys.getsizeof(answer)
+
+
+# Answers to questions that were already asked
+ask_cache = TTLCache(
+    max_entries=int(os.getenv("ASK_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ASK_CACHE_TTL", "21600")),
+    max_bytes=int(os.getenv("ASK_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    sizeof=ask_cache_sizeof
+)
+
+
+# Build the /ask cache key, so small differences in spelling still hit the same entry
+def ask_cache_key(question: str):
+    normalized = " ".join(question.lower().split()).rstrip("?!. ")
+    return (ASK_MODEL, ASK_SYSTEM_PROMPT, normalized)
 
 
 # Global client reference (to be set from the main file)
@@ -18,18 +57,35 @@ def set_client(client):
     _client = client
 
 
+# The OpenAI package takes a while to import, so with LAZY_IMPORTS on it's loaded by the first /ask
+LAZY_IMPORTS = os.getenv("LAZY_IMPORTS", "1") == "1"
+openai = None
+openai_available = None
+
+
 # Try to import OpenAI - with fallback if not available
-try:
-    import openai
-    # Set up the OpenAI API client with the key from the environment
+def load_openai():
+    global openai, openai_available
+
+    if openai_available is not None:
+        return openai_available
+
+    try:
+        import openai as openai_package
+        # Set up the OpenAI API client with the key from the environment
+        openai_package.api_key = os.getenv("OPENAI_API_KEY")
+        openai = openai_package
+        openai_available = True
+
+    except ImportError:
+        openai_available = False
+        print("OpenAI package not installed - /ask command will be unavailable")
+
+    return openai_available
 
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    openai_available = True
 
-except ImportError:
-    import openai
-    openai_available = False
-    print("OpenAI package not installed - /ask command will be unavailable")
+if not LAZY_IMPORTS:
+    load_openai()
 
 
 # the joke token command
@@ -59,33 +115,38 @@ async def owner(interaction: discord.Interaction):
 
 
 # currency exchange
-async def fetch_exchange_rate(target_currency: str) -> Optional[float]:
+async def fetch_rate_table() -> Dict[str, float]:
 
     api_key = os.getenv("fixer_api")
     if not api_key:
-        return None
+        raise RateFetchError("Fixer API key not found")
 
     base_url = "http://data.fixer.io/api/latest"
     params = {
-        "access_key": api_key,
-        "symbols": target_currency
+        "access_key": api_key
     }
 
-    try:
-        response = requests.get(base_url, params=params)
-        data = response.json()
+    data = await http_client.get_json(base_url, params=params)
+
+    if not data.get("success", False):
+        raise RateFetchError(data.get("error", {}).get("info", "Unknown error"))
 
-        if not data.get("success", False):
-            return None
+    # Fixer always returns EUR as base, with every currency it knows in one table
+    return data.get("rates", {})
 
-        rates = data.get("rates", {})
-        target_rate = rates.get(target_currency)
 
-        if target_rate is None:
-            return None
+# Every EUR-based rate, fetched once per interval and shared by all /exchange calls
+rate_table = RateTable(
+    fetch_rate_table,
+    max_age=float(os.getenv("EXCHANGE_RATES_MAX_AGE", "3600")),
+    retry_interval=float(os.getenv("EXCHANGE_RATES_RETRY_INTERVAL", "60"))
+)
 
-        # Since Fixer always returns EUR as base, EUR ➔ target rate is direct
-        return target_rate
+
+async def fetch_exchange_rate(target_currency: str, source_currency: str = "EUR") -> Optional[float]:
+
+    try:
+        return await rate_table.get_rate(source_currency, target_currency)
 
     except Exception as e:
         print(f"Error fetching exchange rate: {e}")
@@ -94,15 +155,16 @@ async def fetch_exchange_rate(target_currency: str) -> Optional[float]:
 async def get_exchange_rate_implementation(
     interaction: discord.Interaction,
     amount: float,
-    target_currency: str
+    target_currency: str,
+    source_currency: str = "EUR"
 ):
     await interaction.response.defer(ephemeral=False)
 
     target = target_currency.upper()
-    source = "EUR"  # Fixed source currency
+    source = source_currency.upper()
 
-    # Get the rate from EUR to target
-    rate = await fetch_exchange_rate(target)
+    # Get the rate from source to target out of the cached table
+    rate = await fetch_exchange_rate(target, source)
 
     if rate is not None:
         converted_amount = amount * rate
@@ -123,7 +185,7 @@ async def get_exchange_rate_implementation(
         await interaction.followup.send(embed=embed)
 
     else:
-        await interaction.followup.send(f"Failed to get exchange rate for {target}. Please check the currency code and try again.")
+        await interaction.followup.send(f"Failed to get exchange rate from {source} to {target}. Please check the currency codes and try again.")
 
 
 # donate command
@@ -166,7 +228,8 @@ async def stats(interaction: discord.Interaction, client=None):
     except AttributeError as attribute_error:
         websocket_latency = f"Unavailable: {attribute_error}"
     
-    # Get memory usage
+    # Get memory usage, psutil is only imported the first time /stats is used
+    import psutil
     process = psutil.Process(os.getpid())
     memory_usage = process.memory_info().rss / 1024 / 1024  # Convert to MB
     
@@ -180,6 +243,66 @@ async def stats(interaction: discord.Interaction, client=None):
     embed.add_field(name="API Latency", value=f"{api_latency} ms", inline=True)
     embed.add_field(name="WebSocket Latency", value=websocket_latency, inline=True)
     embed.add_field(name="Memory Usage", value=f"{memory_usage:.2f} MB", inline=True)
+    embed.add_field(name="Ask Cache", value=f"{ask_cache.hits} hits / {ask_cache.misses} misses ({ask_cache.hit_rate:.0f}%)", inline=True)
+    embed.add_field(name="Weather Cache", value=f"{weather_cache.hit_rate:.0f}% hits, {weather_requests_saved()} requests saved", inline=True)
+    embed.add_field(name="Moderation", value=f"{filter_module.action_queue.api_calls_saved} API calls saved by batching", inline=True)
+    embed.add_field(
+        name="Server Cache",
+        value=f"{len(filter_module.guild_cache)} servers in memory, {filter_module.guild_cache.evictions} evicted "
+              f"({filter_module.guild_cache.eviction_rate}/min)",
+        inline=True
+    )
+
+    # Latency and message rate for every shard
+    shard_metrics = getattr(client, "shard_metrics", None)
+    if client is not None and shard_metrics is not None:
+        latencies = getattr(client, "latencies", None) or [(client.shard_id or 0, client.latency)]
+        shard_lines = []
+
+        for shard_id, shard_latency in latencies:
+            latency_text = f"{round(shard_latency * 1000)} ms" if shard_latency == shard_latency else "connecting"
+            shard_lines.append(f"Shard {shard_id}: {latency_text}, {shard_metrics.rate(shard_id):.1f} msg/s")
+
+        # Embed fields are capped at 1024 characters
+        shard_text = "\n".join(shard_lines)
+        if len(shard_text) > 1024:
+            shard_text = shard_text[:1000].rsplit("\n", 1)[0] + "\n..."
+
+        embed.add_field(name="Shards", value=shard_text, inline=False)
+
+    ingest_queue = getattr(client, "ingest_queue", None)
+    if ingest_queue is not None:
+        embed.add_field(
+            name="Filter Queue",
+            value=f"{ingest_queue.depth} waiting (peak {ingest_queue.max_depth_seen}), "
+                  f"{ingest_queue.shed} messages and {filter_module.action_queue.notices_shed} notices shed",
+            inline=True
+        )
+
+    # p50 / p95 / p99 of every command, pipeline stage and upstream API seen so far
+    latency_lines = []
+    for name, histogram in sorted(latency.recorder.histograms.items()):
+        if not histogram.count:
+            continue
+
+        p50, p95, p99 = (histogram.percentile(percent) * 1000 for percent in (50, 95, 99))
+        errors = f", {histogram.errors} errors" if histogram.errors else ""
+        latency_lines.append(f"{name}: {p50:.0f} / {p95:.0f} / {p99:.0f} ms ({histogram.count}{errors})")
+
+    if latency_lines:
+        latency_text = "\n".join(latency_lines)
+        if len(latency_text) > 1024:
+            latency_text = latency_text[:1000].rsplit("\n", 1)[0] + "\n..."
+
+        embed.add_field(name="Latency (p50 / p95 / p99)", value=latency_text, inline=False)
+
+    startup_timings = getattr(client, "startup_timings", None)
+    if startup_timings:
+        embed.add_field(
+            name="Cold Start",
+            value=", ".join(f"{step} {seconds:.2f}s" for step, seconds in startup_timings.items()),
+            inline=True
+        )
     
     embed.set_footer(text=f"Requested by {interaction.user.name}")
     embed.timestamp = discord.utils.utcnow()
@@ -187,6 +310,44 @@ async def stats(interaction: discord.Interaction, client=None):
     await interaction.followup.send(embed=embed)
 
 
+# Longest window /profile may record for
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+
+# profile the running bot for a while and send the hottest functions, owner only
+async def profile(interaction: discord.Interaction, client=None, seconds: int = 10, messages: int = 0, top: int = 25, sort: str = "cumulative"):
+
+    # Use the global client if one wasn't provided
+    if client is None:
+        client = _client
+
+    if not await client.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot owner can use this command.", ephemeral=True)
+        return
+
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    top = max(5, min(top, 100))
+
+    window = f"{seconds} seconds" if not messages else f"{messages} messages or {seconds} seconds, whichever comes first"
+    await interaction.response.send_message(f"Profiling for {window}...", ephemeral=True)
+
+    try:
+        report = await profiler.profile_window(
+            seconds,
+            messages=max(messages, 0),
+            message_count=lambda: filter_module.messages_scanned,
+            top=top,
+            sort=sort
+        )
+    except profiler.ProfilerBusy as error:
+        await interaction.followup.send(str(error), ephemeral=True)
+        return
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    report_file = discord.File(io.BytesIO(report.encode()), filename=f"profile-{timestamp}.txt")
+    await interaction.followup.send(f"Top {top} functions by {sort} time:", file=report_file, ephemeral=True)
+
+
 # coin flip command
 async def coin(interaction: discord.Interaction):
 
@@ -196,32 +357,123 @@ async def coin(interaction: discord.Interaction):
     await interaction.response.send_message(f"And the outcome was {outcome}!")
 
 
+# Turn a JokeAPI joke into the text we send
+def format_joke(joke_data):
+    if joke_data["type"] == "single":
+        return joke_data["joke"]
+
+    return f"{joke_data['setup']}\n\n{joke_data['delivery']}"
+
+
+# Get a batch of jokes from JokeAPI in one request
+async def fetch_jokes(amount: int = 1):
+    joke_api_url = "https://v2.jokeapi.dev/joke/Any"
+    params = {"amount": amount} if amount > 1 else None
+
+    joke_data = await http_client.get_json(joke_api_url, params=params)
+
+    if joke_data.get("error"):
+        raise RuntimeError(joke_data.get("message", "JokeAPI returned an error"))
+
+    # A single joke comes back on its own, several come back in a list
+    jokes = joke_data["jokes"] if "jokes" in joke_data else [joke_data]
+    return [format_joke(joke) for joke in jokes]
+
+
+# Jokes fetched ahead of time by a background task
+joke_buffer = JokeBuffer(
+    fetch_jokes,
+    size=int(os.getenv("JOKE_BUFFER_SIZE", "20")),
+    low_water=int(os.getenv("JOKE_BUFFER_LOW_WATER", "5"))
+)
+
+
 # joke command
 async def joke(interaction: discord.Interaction):
 
+    # Answer straight away if a joke is already waiting
+    buffered_joke = joke_buffer.pop()
+    if buffered_joke is not None:
+        await interaction.response.send_message(buffered_joke)
+        return
+
     try:
         # Defer the response since we're making an API call
         await interaction.response.defer()
         
-        # Make a direct HTTP request to the JokeAPI service
-        joke_api_url = "https://v2.jokeapi.dev/joke/Any"
-        
-        # Use the request library to get a joke
-        response = requests.get(joke_api_url)
-        joke_data = response.json()
-        
-        if joke_data["type"] == "single":
-            await interaction.followup.send(joke_data["joke"])
-
-        else:
-            setup = joke_data["setup"]
-            delivery = joke_data["delivery"]
-            await interaction.followup.send(f"{setup}\n\n{delivery}")
+        # Fall back to fetching a joke right now
+        jokes = await fetch_jokes()
+        await interaction.followup.send(jokes[0])
             
     except Exception as e:
         await interaction.followup.send(f"I couldn't fetch a joke right now: {str(e)}.")
 
 
+# Weather reports by location, with "not found" answers kept for a shorter time
+weather_cache = TTLCache(
+    max_entries=int(os.getenv("WEATHER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("WEATHER_CACHE_TTL", "600"))
+)
+WEATHER_NEGATIVE_TTL = float(os.getenv("WEATHER_NEGATIVE_TTL", "120"))
+
+# Weatherstack error codes that mean the location doesn't exist
+WEATHER_NOT_FOUND_CODES = {601, 615}
+
+
+# How long a weather result may be reused, errors such as a spent quota are never kept
+def weather_cache_ttl(result):
+    kind, _ = result
+
+    if kind == "found":
+        return weather_cache.ttl
+    if kind == "not_found":
+        return WEATHER_NEGATIVE_TTL
+    return 0
+
+
+# Upstream weather requests avoided thanks to the cache
+def weather_requests_saved():
+    return weather_cache.hits + weather_cache.coalesced
+
+
+# Ask Weatherstack about a location, returns the kind of result and the text to show
+async def fetch_weather(location: str, weather_api_key: str):
+
+    weather_base_url = 'http://api.weatherstack.com/current'
+
+    # Fetch the weather for a given location
+    params = {'access_key': weather_api_key, 'query': location}
+
+    # Make a request to the Weatherstack API
+    data = await http_client.get_json(weather_base_url, params=params)
+
+    # Check for an error from the API
+    if 'error' in data:
+        error_info = data['error']
+        if error_info.get('code') == 104:  # Code 104 = Monthly quota reached
+            return "error", "I'm sorry, but I'm operating on a free plan and I have reached the limit for this month's requests."
+        if error_info.get('code') in WEATHER_NOT_FOUND_CODES:
+            return "not_found", "Sorry, I couldn't find that location. Please check the spelling and try again."
+        return "error", f"Error fetching weather data: {error_info.get('info', 'Unknown error')}"
+
+    if 'current' in data and 'location' in data:
+        current_weather = data['current']
+        location_name = data['location']['name']
+        temperature = current_weather['temperature']
+        weather_descriptions = ', '.join(current_weather.get('weather_descriptions', ['Unknown']))
+        humidity = current_weather.get('humidity', 'Unknown')
+        wind_speed = current_weather.get('wind_speed', 'Unknown')
+
+        # Create a response message
+        return "found", (f"Weather in {location_name}:\n"
+                         f"Temperature: {temperature}°C\n"
+                         f"Condition: {weather_descriptions}\n"
+                         f"Humidity: {humidity}%\n"
+                         f"Wind Speed: {wind_speed} km/h")
+
+    return "not_found", "Sorry, I couldn't retrieve the weather information. Please check the location and try again."
+
+
 # weather command
 async def weather(interaction: discord.Interaction, location: str):
 
@@ -233,40 +485,16 @@ async def weather(interaction: discord.Interaction, location: str):
         await interaction.followup.send("Weather API key not found. Please check your environment variables.")
         return
 
-    weather_base_url = 'http://api.weatherstack.com/current'
-
-    # Fetch and display the weather for a given location
-    params = {'access_key': weather_api_key, 'query': location}
+    # Same city in different spelling or spacing shares one cache entry
+    cache_key = " ".join(location.lower().split())
 
     try:
-        # Make a request to the Weatherstack API
-        response = requests.get(weather_base_url, params=params)
-        data = response.json()
-
-        # Check for an error from the API
-        if 'error' in data:
-            error_info = data['error']
-            if error_info.get('code') == 104:  # Code 104 = Monthly quota reached
-                weather_info = "I'm sorry, but I'm operating on a free plan and I have reached the limit for this month's requests."
-            else:
-                weather_info = f"Error fetching weather data: {error_info.get('info', 'Unknown error')}"
-
-        elif 'current' in data and 'location' in data:
-            current_weather = data['current']
-            location_name = data['location']['name']
-            temperature = current_weather['temperature']
-            weather_descriptions = ', '.join(current_weather.get('weather_descriptions', ['Unknown']))
-            humidity = current_weather.get('humidity', 'Unknown')
-            wind_speed = current_weather.get('wind_speed', 'Unknown')
-
-            # Create a response message
-            weather_info = (f"Weather in {location_name}:\n"
-                          f"Temperature: {temperature}°C\n"
-                          f"Condition: {weather_descriptions}\n"
-                          f"Humidity: {humidity}%\n"
-                          f"Wind Speed: {wind_speed} km/h")
-        else:
-            weather_info = "Sorry, I couldn't retrieve the weather information. Please check the location and try again."
+        # Lookups for the same city at the same time share one request
+        _, weather_info = await weather_cache.get_or_load(
+            cache_key,
+            lambda: fetch_weather(location, weather_api_key),
+            ttl=weather_cache_ttl
+        )
     
     except Exception as e:
         weather_info = f"Error processing weather data: {str(e)}"
@@ -299,14 +527,17 @@ async def magic8ball(interaction: discord.Interaction, message: str = None):
 # send the question to ChatGPT
 async def ask(interaction: discord.Interaction, question: str):
 
-    # Check if OpenAI is available
+    # Defer the response since API calls (and importing OpenAI the first time) might take some time
+    await interaction.response.defer()
+
+    # Check if OpenAI is available, importing it off the event loop on first use
+    if openai_available is None:
+        await asyncio.to_thread(load_openai)
+
     if not openai_available:
-        await interaction.response.send_message("Sorry, the OpenAI integration is not available. Please contact the bot administrator.")
+        await interaction.followup.send("Sorry, the OpenAI integration is not available. Please contact the bot administrator.")
         return
     
-    # Defer the response since API calls might take some time
-    await interaction.response.defer()
-    
     try:
         # Get the API key from the environment variable
         api_key = os.getenv("OPENAI_API_KEY")
@@ -318,29 +549,59 @@ async def ask(interaction: discord.Interaction, question: str):
         # Set the API key (in case it changed from module import)
         openai.api_key = api_key
 
-        # Send the request to ChatGPT
-        response = openai.ChatCompletion.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "system",
-                "content": "You are a helpful assistant. Avoid using emojis and do not use more than 2k characters. Instead of writing a list, structure your response in a paragraph like you're personally talking to someone."
-            }, {
-                "role": "user",
-                "content": question
-            }],
-            max_tokens=1000)
-
-        # Extract the answer from the response
-        answer = response.choices[0].message["content"]
-
-        # Send the answer back to Discord
-        await interaction.followup.send(answer)
+        # Wait for a free slot, then send the request to ChatGPT without blocking the event loop
+        guild_id = interaction.guild.id if interaction.guild else None
+        answered = False
+
+        async def fetch_answer():
+            nonlocal answered
+
+            async with ask_limiter.slot(guild_id):
+                # With streaming on, this is the time until the answer starts arriving
+                with latency.timed("upstream openai"):
+                    response = await openai.ChatCompletion.acreate(
+                        model=ASK_MODEL,
+                        messages=[{
+                            "role": "system",
+                            "content": ASK_SYSTEM_PROMPT
+                        }, {
+                            "role": "user",
+                            "content": question
+                        }],
+                        max_tokens=1000,
+                        stream=ASK_STREAM,
+                        request_timeout=float(os.getenv("ASK_TIMEOUT", "60")))
+
+                if ASK_STREAM:
+                    # Show the answer while it is being written
+                    answer = await ask_stream.stream_completion(response, interaction.followup, ASK_STREAM_EDIT_INTERVAL)
+                    answered = bool(answer)
+                else:
+                    # Extract the answer from the response
+                    answer = response.choices[0].message["content"]
+
+            return answer or None
+
+        # Repeated questions are answered from the cache, identical ones in flight share one request
+        answer = await ask_cache.get_or_load(ask_cache_key(question), fetch_answer)
+
+        if not answer:
+            await interaction.followup.send("Sorry, I couldn't come up with an answer.")
+            return
+
+        # Send the answer back to Discord, unless it was already streamed
+        if not answered:
+            for start in range(0, len(answer), ask_stream.DISCORD_MESSAGE_LIMIT):
+                await interaction.followup.send(answer[start:start + ask_stream.DISCORD_MESSAGE_LIMIT])
         
         # Send the disclaimer as a follow-up message
         await asyncio.sleep(2)
         follow_up_message = "With that said, there is a non-zero possibility for errors. So please, take this with a grain of salt and fact-check your answers, thank you."
         await interaction.followup.send(follow_up_message)
 
+    except LimiterBusy:
+        await interaction.followup.send(ASK_BUSY_MESSAGE)
+
     except Exception as e:
         await interaction.followup.send(f"Sorry, I encountered an error: {str(e)}.")
         
@@ -383,7 +644,7 @@ async def helpme(interaction: discord.Interaction):
         "***`/help`*** - Shows this commands list.\n"
         "***`/weather`*** - Gives info on the weather in a given city.\n"
         "***`/ask`*** - Uses AI to answer your question.\n"
-        "***`/exchange`*** - Converts EUR into other currencies\n",
+        "***`/exchange`*** - Converts between currencies\n",
         inline=False
     )
 
@@ -0,0 +1,122 @@
+# Aho-Corasick automaton used to find every filtered word in a single pass over a message
+
+
+class WordMatcher:
+
+    def __init__(self, words=()):
+        # Trie transitions, one dict per node (node 0 is the root)
+        self._goto = [{}]
+        # Word that ends at each node, if any
+        self._terminal = [None]
+        # Failure links and output lists, rebuilt lazily after edits
+        self._fail = [0]
+        self._output = [()]
+        self._dirty = False
+
+        # Position of each word in the filter list, used to keep results in list order
+        self._order = {}
+        self._next_index = 0
+
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __contains__(self, word):
+        return word.lower() in self._order
+
+    # Insert a word into the trie, failure links are recomputed on the next search
+    def add(self, word):
+        word = word.lower()
+        if word in self._order:
+            return
+
+        self._order[word] = self._next_index
+        self._next_index += 1
+
+        node = 0
+        for char in word:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._terminal.append(None)
+            node = next_node
+
+        self._terminal[node] = word
+        self._dirty = True
+
+    # Drop a word, its trie nodes are kept and simply stop producing output
+    def remove(self, word):
+        word = word.lower()
+        if self._order.pop(word, None) is None:
+            return
+
+        node = 0
+        for char in word:
+            node = self._goto[node][char]
+
+        self._terminal[node] = None
+        self._dirty = True
+
+    # Breadth-first pass computing failure links and merged outputs
+    def _build(self):
+        node_count = len(self._goto)
+        fail = [0] * node_count
+        output = [()] * node_count
+        terminal = self._terminal
+
+        output[0] = (terminal[0],) if terminal[0] is not None else ()
+
+        queue = list(self._goto[0].values())
+
+        for node in queue:
+            own = (terminal[node],) if terminal[node] is not None else ()
+            output[node] = own + output[fail[node]]
+
+            for char, child in self._goto[node].items():
+                state = fail[node]
+                while state and char not in self._goto[state]:
+                    state = fail[state]
+                fail[child] = self._goto[state].get(char, 0)
+                queue.append(child)
+
+        self._fail = fail
+        self._output = output
+        self._dirty = False
+
+    # Build the failure links now instead of on the first search
+    def compile(self):
+        if self._dirty:
+            self._build()
+
+        return self
+
+    # Return every word found in the text, in the order they were added
+    def find_all(self, text):
+        if not self._order:
+            return []
+
+        if self._dirty:
+            self._build()
+
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set(output[0])
+
+        node = 0
+        for char in text.lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+
+        if not found:
+            return []
+
+        order = self._order
+        return sorted(found, key=order.__getitem__)